@@ -29,226 +29,138 @@ __author__ = 'Kevin McGuinness'
 
 import gedit
 import gtk
-import re
+import gobject
 import gconf
+import os
+import sys
+import urllib
+import time
+from tm_autocomplete_core import TextBuffer, VocabularyCache, AutoCompleter, \
+  Statistics, VocabularyStore, ProjectIndex, AcceptHistory, MatchCache, \
+  ScanBudget, CompletionRequest, WordLists, TraceRecorder
 
 # The default trigger: a (keyval, mod) pair
 DEFAULT_TRIGGER = (gtk.keysyms.Escape, 0)
 
-def uniq_order_preserved(v):
-  z, s = [], set()
-  for x in v:
-    if x not in s:
-      s.add(x)
-      z.append(x)
-  return z
-
-def zip_no_truncation(v,w):
-  z = []
-  for i in range(max(len(v),len(w))):
-    if i < len(v):
-      z.append(v[i])
-    if i < len(w):
-      z.append(w[i])
-  return z
-
-class AutoCompleter(object):
-  """Class that actually does the autocompletion"""
-
-  IgnoreUnderscore = True
-  ValidScopes = ('document', 'window', 'application')
-  ValidOrders = ('alphabetical', 'proximity')
-  LastAcceptedMatch = None
+class GeditBuffer(TextBuffer):
+  """Text buffer interface to a gedit document. The insert-text and
+     delete-range signals of the document are passed on to the observers.
+  """
 
   __slots__ = (
-    'doc',       # The document autocomplete was initiated on
-    'word',      # Word being completed
-    'matches',   # List of potential autocompletions
-    'index',     # Index of the next autocompletion to suggest
-    'iter_s',    # GtkTextIterator pointing to the start of word being completed
-    'iter_i',    # GtkTextIterator pointing to insertion point
-    'iter_e',    # GtkTextIterator pointing to end of last insertion
-    'scope',     # Search scope (document|application|window)
-    'order',     # Result list ordering (proximity|alphabetical)
-    'promote',   # Promote last accepted match
+    'doc',       # The gedit document
+    'observers', # Objects told about changes to the text
+    'handlers',  # Signal handler ids connected on the document
+    'pending',   # First line of the edit in progress
   )
 
-  def __init__(self, doc, scope='document', order='alphabetical', 
-    promote=False):
-    """Create an autocompleter for the document. Indexes the words in the 
-       current scope and builds a list of matches for the current cursor 
-       position. Calling insert_next_completion will cycle through the matches,
-       replacing the last match inserted (if any).
-
-       If order is 'alphabetical' then the autocompletion list is ordered 
-       alphabetically. If order is 'proximity' then the autocompletion list
-       is ordered based on distance from the cursor in the current document,
-       with the other open documents being ordered alphabetcially.
-    """
-    self.scope = scope
-    self.order = order
-    self.promote = promote
-    self.reindex(doc)
-
-  def _get_iter_for_beginning_of_word_at(self, iter1):
-    """Returns a GtkTextIter pointing to the start of the current word"""
-    if not self.IgnoreUnderscore:
-      # Just use pango's word start facility
-      result = iter1.copy()
-      result.backward_word_start()
-    else:
-      # Including underscores in the words
-      i = iter1.copy()
-      while not i.starts_sentence() and i.backward_char():
-        ch = i.get_char()
-        if ch.isalnum() or ch == '_':
-          continue
-        else:
-          i.forward_char()
-          break
-      result = i 
-    return result
-
-  def _can_autocomplete_at(self, iter1):
-    """Returns true if autocompletion can be done at the given iterator"""
-    if iter1.ends_word() or iter1.inside_word():
-      return True
-    if self.IgnoreUnderscore:
-      i = iter1.copy()
-      if not i.starts_sentence() and i.backward_char() and i.get_char() == '_':
-        return True
-    return False
+  @staticmethod
+  def get(doc):
+    """Returns the text buffer of the document, creating it if needed"""
+    buffer = getattr(doc, 'autocomplete_buffer', None)
+    if buffer is None:
+      buffer = GeditBuffer(doc)
+      setattr(doc, 'autocomplete_buffer', buffer)
+    return buffer
 
-  def _get_current_doc_words_sorted_by_proximity(self, regex):
-    """Returns the words in the current document sorted by distance from 
-       cursor.
-    """
-    fwd_text = self.doc.get_text(self.iter_i, self.doc.get_end_iter())
-    bck_text = self.doc.get_text(self.doc.get_start_iter(), self.iter_s)
-    fwd_words = regex.findall(fwd_text)
-    bck_words = regex.findall(bck_text)
-    bck_words.reverse()
-    all_words = zip_no_truncation(bck_words, fwd_words)
-    return uniq_order_preserved(all_words)
-
-  def _get_current_doc_words(self, regex):
-    """Returns an unsorted list of words in the current document. The given 
-       regex is used to match the words.
-    """
-    iter1 = self.doc.get_start_iter()
-    iter2 = self.doc.get_end_iter()
-    text = self.doc.get_text(iter1, iter2)
-    words = set(regex.findall(text))
-    return list(words)
-
-  def _get_other_doc_words(self, regex):
-    """Returns an unsorted list of words in the non-current document based
-       on the selected scope. The given regex is used to match the words.
-    """
-    if self.scope == 'application':
-      # Index all documents open in any gedit window
-      docs = gedit.app_get_default().get_documents()
-    elif self.scope == 'window':
-      # Index all documents in this gedit window
-      docs = gedit.app_get_default().get_active_window().get_documents()
-    else:
-      # No other documents in use
-      docs = []
-    words = set()
-    for doc in docs:
-      if doc != self.doc:
-        text = doc.get_text(doc.get_start_iter(), doc.get_end_iter())
-        words.update(regex.findall(text))
-    return list(words)
-
-  def _create_regex_for_prefix(self, prefix):
-    """Compiles a regular expression that matches words beginning with the 
-       given prefix. If the prefix is empty, a match-any-word regular 
-       expression is created.
-    """
-    return re.compile(r'\b' + prefix + r'\w+\b')
-
-  def _get_candidate_matches(self, doc, prefix):
-    """Returns all words in the document that match the given word"""
-    regex = self._create_regex_for_prefix(prefix)
-    if self.order == 'alphabetical':
-      # Alphabetical sort
-      words = self._get_current_doc_words(regex)
-      other = self._get_other_doc_words(regex) 
-      words.extend(other)
-      words.sort()
-    else:
-      # Proximity sort in current doc, alphabetical in others
-      words = self._get_current_doc_words_sorted_by_proximity(regex)
-      other = self._get_other_doc_words(regex) 
-      other.sort()
-      words.extend(other)
-    return uniq_order_preserved(words)
-
-  def _should_promote_last_accepted(self, prefix):
-    last = AutoCompleter.LastAcceptedMatch
-    return (last is not None and self.promote and
-      len(prefix) > len(last) and last.startswith(prefix))
-
-  def reindex(self, doc):
-    """Compile a list of candidate words for autocompletion"""
+  def __init__(self, doc):
     self.doc = doc
-    self.word = None
-    self.matches = []
-    self.index = 0
-    self.iter_e = None
-    self.iter_i = doc.get_iter_at_mark(doc.get_insert())
-    if self._can_autocomplete_at(self.iter_i):
-      self.iter_s = self._get_iter_for_beginning_of_word_at(self.iter_i)
-      self.iter_e = self.iter_i.copy()
-      self.word = doc.get_text(self.iter_s, self.iter_i)
-      self.matches = self._get_candidate_matches(doc, self.word)
-      if self._should_promote_last_accepted(self.word):
-        self.matches.remove(self.LastAcceptedMatch)
-        self.matches.insert(0, self.LastAcceptedMatch)
-    return len(self.matches) > 0
-
-  def has_completions(self):
-    """Returns true if we can do autocompletion"""
-    return 0 <= self.index < len(self.matches)
-
-  def insert_next_completion(self):
-    """Insert the next autocompletion into the document and move the cursor
-       to the end of the completion. The previous autocompletion is removed.
-    """
-    insert_ok = self.has_completions()
-    if insert_ok:
-      self.doc.begin_user_action()
-      
-      # Store insertion offset
-      insertion_point = self.iter_i.get_offset()
-      
-      # Remove previous completions
-      if not self.iter_i.equal(self.iter_e):
-        self.doc.delete(self.iter_i, self.iter_e)
-        self.iter_i = self.doc.get_iter_at_offset(insertion_point)
-      
-      # Insert new completion
-      match = self.matches[self.index]
-      completion = match[len(self.word):]
-      self.doc.insert(self.iter_i, completion, len(completion))
-      AutoCompleter.LastAcceptedMatch = match
-      
-      # Update iterators
-      self.iter_i = self.doc.get_iter_at_offset(insertion_point)
-      self.iter_e = self.iter_i.copy()
-      self.iter_s = self.iter_i.copy()
-      self.iter_e.forward_chars(len(completion))
-      self.iter_s.backward_chars(len(match))
-      
-      # Move cursor
-      self.doc.place_cursor(self.iter_e)
-      
-      # Next completion
-      self.index = self.index + 1 if self.index + 1 < len(self.matches) else 0
-      self.doc.end_user_action()
-    
-    return insert_ok
+    self.observers = []
+    self.handlers = ()
+    self.pending = None
+
+  def _get_iter(self, position):
+    line, column = position
+    return self.doc.get_iter_at_line_offset(line, column)
+
+  def get_line_count(self):
+    return self.doc.get_line_count()
+
+  def get_lines_text(self, first, last):
+    iter1 = self.doc.get_iter_at_line(first)
+    iter2 = self.doc.get_iter_at_line(last)
+    if not iter2.ends_line():
+      iter2.forward_to_line_end()
+    return self.doc.get_text(iter1, iter2)
+
+  def get_text(self, start, end):
+    return self.doc.get_text(self._get_iter(start), self._get_iter(end))
+
+  def get_cursor(self):
+    iter1 = self.doc.get_iter_at_mark(self.doc.get_insert())
+    return iter1.get_line(), iter1.get_line_offset()
+
+  def place_cursor(self, position):
+    self.doc.place_cursor(self._get_iter(position))
+
+  def insert(self, position, text):
+    self.doc.insert(self._get_iter(position), text, len(text))
+
+  def delete(self, start, end):
+    self.doc.delete(self._get_iter(start), self._get_iter(end))
+
+  def begin_user_action(self):
+    self.doc.begin_user_action()
+
+  def end_user_action(self):
+    self.doc.end_user_action()
+
+  def get_file(self):
+    uri = self.doc.get_uri()
+    if uri and uri.startswith('file://'):
+      return urllib.unquote(uri[len('file://'):])
+    return None
+
+  def get_language(self):
+    language = self.doc.get_language()
+    return language.get_id() if language is not None else None
+
+  def is_modified(self):
+    return self.doc.get_modified()
+
+  def add_observer(self, observer):
+    if not self.observers:
+      doc = self.doc
+      self.handlers = (
+        doc.connect('insert-text', self.on_before_insert_text),
+        doc.connect_after('insert-text', self.on_insert_text),
+        doc.connect('delete-range', self.on_before_delete_range),
+        doc.connect_after('delete-range', self.on_delete_range),
+      )
+    self.observers.append(observer)
+
+  def remove_observer(self, observer):
+    self.observers.remove(observer)
+    if not self.observers:
+      for handler_id in self.handlers:
+        self.doc.disconnect(handler_id)
+      self.handlers = ()
+
+  def on_before_insert_text(self, doc, iter1, text, length):
+    self.pending = line = iter1.get_line()
+    for observer in list(self.observers):
+      observer.before_insert(self, line)
+
+  def on_insert_text(self, doc, iter1, text, length):
+    # Iterator now points to the end of the inserted text
+    first, last = self.pending, iter1.get_line()
+    for observer in list(self.observers):
+      observer.after_insert(self, first, last)
+    self.pending = None
+
+  def on_before_delete_range(self, doc, iter1, iter2):
+    self.pending = first = iter1.get_line()
+    last = iter2.get_line()
+    everything = iter1.is_start() and iter2.is_end()
+    for observer in list(self.observers):
+      observer.before_delete(self, first, last, everything)
+
+  def on_delete_range(self, doc, iter1, iter2):
+    # Both iterators now point to where the text was removed
+    first = self.pending
+    for observer in list(self.observers):
+      observer.after_delete(self, first)
+    self.pending = None
 
 
 class AutoCompletionPlugin(gedit.Plugin):
@@ -257,36 +169,136 @@ class AutoCompletionPlugin(gedit.Plugin):
   # Where our configuration data is held
   ConfigRoot = '/apps/gedit-2/plugins/tm_autocomplete'
 
+  # Number of triggers between writes of the statistics
+  StatsDumpInterval = 100
+
+  # Where the vocabularies of the files are stored
+  VocabularyDir = '~/.gnome2/gedit/tm_autocomplete/vocabulary'
+
+  # Where the word lists are found by default, and where their sorted words
+  # are stored
+  WordListsDir = '~/.gnome2/gedit/tm_autocomplete/wordlists'
+  SortedWordListsDir = '~/.gnome2/gedit/tm_autocomplete/wordlists-sorted'
+
+  # Seconds between refreshes of the project index
+  ProjectRefreshInterval = 60
+
+  # Megabytes the document indexes may take before the least recently
+  # searched ones are evicted (0 for no limit)
+  MemoryLimit = 64
+
+  # Lines scanned either side of the cursor, and milliseconds a trigger may
+  # spend scanning and ranking (0 for no limit)
+  ScanLines = 1024
+  ScanTime = 100
+
   def __init__(self):
     self.autocompleter = None
+    self.request = None
+    # The stored vocabularies are opened once the plugin is configured
+    self.vocabulary = VocabularyCache(self.idle_add, gobject.source_remove,
+      None, self.MemoryLimit << 20, timeout_add=gobject.timeout_add)
+    self.statistics = None
+    self.history = AcceptHistory()
+    self.matches = MatchCache()
+    self.budget = ScanBudget(self.ScanLines, self.ScanTime / 1000.0)
+    self.project = None
     self.trigger = DEFAULT_TRIGGER
     self.scope = 'document'
     self.order = 'proximity'
     self.promote_last_accepted = True
+    self.fuzzy = False
+    self.smart_case = False
+    self.preview = False
+    self.preview_view = None
+    self.stats_file = ''
+    self.project_root = ''
+    self.project_ignore = ProjectIndex.DefaultIgnore
+    self.word_lists_dir = self.WordListsDir
+    self.word_lists = None
+    self.trace_file = ''
+    self.trace = None
+    self.traced = []
+    self.gconf_client = None
+    self.windows = 0
+    self.startup_times = []
     gedit.Plugin.__init__(self)
 
   def activate(self, window):
-    self.gconf_activate()
-    self.update_ui(window)
+    # Nothing is read or indexed until autocompletion is first used (see
+    # configure), so restoring a session with many tabs stays quick
+    start = time.time()
+    self.windows += 1
+    id1 = window.connect('tab-added', self.on_tab_added)
+    id2 = window.connect('tab-removed', self.on_tab_removed)
+    id3 = window.connect('active-tab-changed', self.on_active_tab_changed)
+    setattr(window, 'autocomplete_handlers', (id1, id2, id3))
+    for view in window.get_views():
+      self.attach_view(view)
+    self.record_startup('activate', start)
 
   def deactivate(self, window):
     for view in window.get_views():
       for handler_id in getattr(view, 'autocomplete_handlers', []):
         view.disconnect(handler_id)
-      setattr(view, 'autocomplete_handlers_attached', False)
+      setattr(view, 'autocomplete_handlers', ())
+    for handler_id in getattr(window, 'autocomplete_handlers', []):
+      window.disconnect(handler_id)
+    setattr(window, 'autocomplete_handlers', ())
+    for doc in window.get_documents():
+      self.untrace_document(doc)
+      self.vocabulary.drop(GeditBuffer.get(doc))
+    self.cancel_request()
     self.autocompleter = None   
-    self.gconf_deactivate()
-
-  def update_ui(self, window):
-    view = window.get_active_view()
-    doc = window.get_active_document()
-    if isinstance(view, gedit.View) and doc:
-      if not getattr(view, 'autocomplete_handlers_attached', False):
-        setattr(view, 'autocomplete_handlers_attached', True)
-        self.autocompleter = None
-        id1 = view.connect('key-press-event', self.on_key_press, doc)
-        id2 = view.connect('button-press-event', self.on_button_press, doc)
-        setattr(view, 'autocomplete_handlers', (id1, id2))
+    self.preview_view = None
+    self.matches.clear()
+    self.dump_statistics()
+    if self.trace is not None:
+      self.trace.flush()
+    self.windows -= 1
+    if self.windows == 0:
+      # The other windows still use the project index, the word lists, the
+      # stored vocabularies, the trace and the settings
+      self.close_project()
+      self.close_word_lists()
+      self.close_trace()
+      # Opened again once configured
+      self.trace_file = ''
+      if self.vocabulary.store is not None:
+        self.vocabulary.store.close()
+        self.vocabulary.store = None
+      self.gconf_deactivate()
+
+  def attach_view(self, view):
+    """Connects the handlers of the view, once when its tab is added"""
+    if isinstance(view, gedit.View) and \
+      not getattr(view, 'autocomplete_handlers', ()):
+      doc = view.get_buffer()
+      id1 = view.connect('key-press-event', self.on_key_press, doc)
+      id2 = view.connect('button-press-event', self.on_button_press, doc)
+      id3 = view.connect_after('expose-event', self.on_view_expose)
+      setattr(view, 'autocomplete_handlers', (id1, id2, id3))
+
+  def configure(self):
+    """Reads the settings and starts following their changes, the first
+       time autocompletion is used or configured
+    """
+    if self.gconf_client is not None:
+      return
+    start = time.time()
+    self.vocabulary.store = VocabularyStore(
+      os.path.expanduser(self.VocabularyDir))
+    self.gconf_activate()
+    self.record_startup('configure', start)
+
+  def record_startup(self, phase, start):
+    """Records the time since start as spent in the given phase of the
+       startup. The times are reported with the trigger statistics.
+    """
+    seconds = time.time() - start
+    self.startup_times.append((phase, seconds))
+    if self.statistics is not None:
+      self.statistics.add_startup_time(phase, seconds)
 
   def is_autocomplete_trigger(self, event):
     keyval, modifiers = self.trigger
@@ -296,45 +308,401 @@ class AutoCompletionPlugin(gedit.Plugin):
     return event.keyval == keyval
 
   def on_key_press(self, view, event, doc):
+    self.configure()
+    self.trace_document(doc)
     if self.is_autocomplete_trigger(event):
+      if self.request is not None:
+        # Still looking for the next completion
+        return True
+      stats = self.statistics
+      if stats is not None:
+        stats.begin_trigger()
       if not self.autocompleter:
-        self.autocompleter = AutoCompleter(doc, self.scope, self.order,
-          self.promote_last_accepted)
-      if self.autocompleter and self.autocompleter.has_completions():
-        self.autocompleter.insert_next_completion()
-      else:
-        self.autocompleter = None
+        self.record_settings()
+      if self.trace is not None:
+        # The other documents searched are replayed too
+        for buffer in self.get_scope_documents(self.scope):
+          self.trace_document(buffer.doc)
+        self.trace.record_trigger(GeditBuffer.get(doc))
+      if not self.autocompleter:
+        self.autocompleter = AutoCompleter(GeditBuffer.get(doc), self.scope,
+          self.order, self.promote_last_accepted, self.vocabulary,
+          self.get_scope_documents, stats, self.get_project(), self.history,
+          self.fuzzy, self.matches, self.budget, self.get_word_lists(),
+          self.smart_case)
+      # The completion is offered once found, unless the user does something
+      # else first
+      self.request = CompletionRequest(self.autocompleter,
+        lambda completer: self.on_completion_found(view, completer),
+        gobject.idle_add, gobject.source_remove)
+      self.request.start()
       return True
     elif self.autocompleter:
-      self.autocompleter = None
+      if event.keyval == gtk.keysyms.BackSpace and \
+        self.autocompleter.preview is not None:
+        # Dismiss the completion previewed
+        self.cancel_request()
+        if self.trace is not None:
+          self.trace.record_cancel(self.autocompleter.doc)
+        self.autocompleter = None
+        self.hide_preview()
+        return True
+      self.accept_completion()
     return False
 
+  def on_completion_found(self, view, completer):
+    self.request = None
+    if completer is not self.autocompleter:
+      return
+    self.pause_trace(True)
+    try:
+      if self.preview and completer.preview_next_completion():
+        self.show_preview(view)
+      elif not self.preview and completer.has_completions():
+        completer.insert_next_completion()
+      else:
+        self.autocompleter = None
+    finally:
+      self.pause_trace(False)
+    self.end_trigger()
+
+  def end_trigger(self):
+    stats = self.statistics
+    if stats is not None and stats.current is not None:
+      stats.end_trigger(len(self.autocompleter.matches)
+        if self.autocompleter else 0)
+      if stats.triggers % self.StatsDumpInterval == 0:
+        self.dump_statistics()
+
+  def cancel_request(self):
+    """Stops looking for the next completion (if it is being looked for)"""
+    if self.request is not None:
+      self.request.cancel()
+      self.request = None
+      self.end_trigger()
+
   def on_button_press(self, view, event, doc):
+    self.trace_document(doc)
     if self.autocompleter:
-      self.autocompleter = None
+      self.accept_completion()
+    return False
+
+  def on_active_tab_changed(self, window, tab):
+    if self.autocompleter:
+      self.accept_completion()
+    if self.trace is not None:
+      doc = tab.get_document()
+      self.trace_document(doc)
+      self.trace.record_switch(GeditBuffer.get(doc))
+
+  def accept_completion(self):
+    # The user stopped cycling (or did something else before the completion
+    # was found), the completion inserted last (or previewed) is accepted
+    self.cancel_request()
+    self.pause_trace(True)
+    try:
+      self.autocompleter.insert_preview()
+    finally:
+      self.pause_trace(False)
+    self.autocompleter.accept()
+    if self.trace is not None:
+      self.trace.record_accept(self.autocompleter.doc)
+      self.trace.flush()
+    self.autocompleter = None
+    self.hide_preview()
+
+  def redraw_cursor_line(self, view):
+    """Redraws the line of the cursor in the view"""
+    buf = view.get_buffer()
+    y, height = view.get_line_yrange(buf.get_iter_at_mark(buf.get_insert()))
+    x, y = view.buffer_to_window_coords(gtk.TEXT_WINDOW_TEXT, 0, y)
+    window = view.get_window(gtk.TEXT_WINDOW_TEXT)
+    if window is not None:
+      width = window.get_size()[0]
+      window.invalidate_rect(gtk.gdk.Rectangle(0, y, width, height), False)
+
+  def show_preview(self, view):
+    if self.preview_view is not None and self.preview_view is not view:
+      self.redraw_cursor_line(self.preview_view)
+    self.preview_view = view
+    self.redraw_cursor_line(view)
+
+  def hide_preview(self):
+    if self.preview_view is not None:
+      self.redraw_cursor_line(self.preview_view)
+      self.preview_view = None
+
+  def on_view_expose(self, view, event):
+    # Draws the completion previewed over the text after the cursor
+    completer = self.autocompleter
+    window = view.get_window(gtk.TEXT_WINDOW_TEXT)
+    if completer is None or view is not self.preview_view or \
+      event.window != window:
+      return False
+    preview = completer.get_preview()
+    if preview is None:
+      return False
+    column, text = preview
+    buf = view.get_buffer()
+    rect = view.get_iter_location(buf.get_iter_at_line_offset(completer.line,
+      column))
+    x, y = view.buffer_to_window_coords(gtk.TEXT_WINDOW_TEXT, rect.x, rect.y)
+    layout = view.create_pango_layout(text)
+    width, height = layout.get_pixel_size()
+    style = view.get_style()
+    window.draw_rectangle(style.base_gc[gtk.STATE_NORMAL], True, x, y, width,
+      max(height, rect.height))
+    window.draw_layout(style.text_gc[gtk.STATE_INSENSITIVE], x, y, layout)
     return False
 
+  def on_tab_added(self, window, tab):
+    self.attach_view(tab.get_view())
+    if self.gconf_client is not None:
+      # Start indexing the document in the background, unless the tab is
+      # restored with the session
+      self.vocabulary.get_index(GeditBuffer.get(tab.get_document()))
+
+  def on_tab_removed(self, window, tab):
+    self.cancel_request()
+    self.autocompleter = None
+    self.hide_preview()
+    self.matches.clear()
+    doc = tab.get_document()
+    self.untrace_document(doc)
+    self.vocabulary.drop(GeditBuffer.get(doc))
+
+  def idle_add(self, callback):
+    # Indexing must not delay redrawing or input handling
+    return gobject.idle_add(callback, priority=gobject.PRIORITY_LOW)
+
+  def get_scope_documents(self, scope):
+    if scope in ('application', 'project'):
+      # Index all documents open in any gedit window
+      docs = gedit.app_get_default().get_documents()
+    elif scope == 'window':
+      # Index all documents in this gedit window
+      docs = gedit.app_get_default().get_active_window().get_documents()
+    else:
+      # No other documents in use
+      docs = []
+    return [GeditBuffer.get(doc) for doc in docs]
+
+  def get_project(self):
+    """Returns the index of the project directory if the project scope is
+       selected, starting a refresh of the index if it is due
+    """
+    if self.scope != 'project' or not self.project_root:
+      return None
+    if self.project is None:
+      self.project = ProjectIndex(os.path.expanduser(self.project_root),
+        self.project_ignore, idle_add=self.idle_add,
+        source_remove=gobject.source_remove, timeout_add=gobject.timeout_add)
+    project = self.project
+    if not project.is_refreshing() and (project.refreshed is None or
+      time.time() - project.refreshed > self.ProjectRefreshInterval):
+      # Scanned and tokenized in the background
+      project.refresh(wait=False)
+    return project
+
+  def close_project(self):
+    if self.project is not None:
+      self.project.close()
+      self.project = None
+
+  def set_project_root(self, project_root):
+    if project_root != self.project_root:
+      self.project_root = project_root or ''
+      self.close_project()
+
+  def get_word_lists(self):
+    """Returns the word lists searched after the documents (or None if
+       there is no word lists directory). Nothing is read until a list is
+       searched, the lists are then sorted in the background.
+    """
+    if not self.word_lists_dir:
+      return None
+    if self.word_lists is None:
+      self.word_lists = WordLists(os.path.expanduser(self.word_lists_dir),
+        os.path.expanduser(self.SortedWordListsDir),
+        timeout_add=gobject.timeout_add, source_remove=gobject.source_remove)
+    return self.word_lists
+
+  def close_word_lists(self):
+    if self.word_lists is not None:
+      self.word_lists.close()
+      self.word_lists = None
+
+  def set_word_lists_dir(self, word_lists_dir):
+    if word_lists_dir != self.word_lists_dir:
+      self.word_lists_dir = word_lists_dir or ''
+      self.cancel_request()
+      self.close_word_lists()
+      self.autocompleter = None
+
+  def set_project_ignore(self, project_ignore):
+    if project_ignore is not None and project_ignore != self.project_ignore:
+      self.project_ignore = project_ignore
+      self.close_project()
+
   def set_scope(self, scope):
     if scope != self.scope and scope in AutoCompleter.ValidScopes:
       self.scope = scope
-      self.autocompleter = None
       return True
     return False
 
   def set_order(self, order):
     if order != self.order and order in AutoCompleter.ValidOrders:
       self.order = order
-      self.autocompleter = None
       return True
     return False
 
   def set_promote_last_accepted(self, promote_last_accepted):
     if self.promote_last_accepted != promote_last_accepted:
       self.promote_last_accepted = promote_last_accepted
+      return True
+    return False
+
+  def set_fuzzy(self, fuzzy):
+    if self.fuzzy != fuzzy:
+      self.fuzzy = fuzzy
+      return True
+    return False
+
+  def set_smart_case(self, smart_case):
+    if self.smart_case != smart_case:
+      self.smart_case = smart_case
+      return True
+    return False
+
+  def set_preview(self, preview):
+    if self.preview != preview:
+      self.preview = preview
+      # The completion being looked for or previewed is dropped
+      self.cancel_request()
       self.autocompleter = None
+      self.hide_preview()
       return True
     return False
 
+  def set_instrument(self, instrument):
+    if instrument and self.statistics is None:
+      self.statistics = Statistics()
+      for phase, seconds in self.startup_times:
+        self.statistics.add_startup_time(phase, seconds)
+    elif not instrument and self.statistics is not None:
+      self.dump_statistics()
+      self.statistics = None
+    else:
+      return False
+    return True
+
+  def set_memory_limit(self, megabytes):
+    """Sets the megabytes the document indexes may take (0 for no limit)"""
+    self.vocabulary.memory_limit = max(megabytes or 0, 0) << 20 or None
+    self.vocabulary.limit_memory()
+
+  def get_memory_limit(self):
+    return (self.vocabulary.memory_limit or 0) >> 20
+
+  def set_scan_lines(self, lines):
+    """Sets the lines scanned either side of the cursor (0 for no limit)"""
+    self.budget.lines = lines if lines and lines > 0 else None
+    self.matches.clear()
+
+  def set_scan_time(self, milliseconds):
+    """Sets the milliseconds a trigger may spend scanning (0 for no limit)"""
+    if milliseconds and milliseconds > 0:
+      self.budget.seconds = milliseconds / 1000.0
+    else:
+      self.budget.seconds = None
+    self.matches.clear()
+
+  def set_stats_file(self, stats_file):
+    self.stats_file = stats_file or ''
+
+  def set_trace_file(self, trace_file):
+    if trace_file != self.trace_file:
+      self.close_trace()
+      self.trace_file = trace_file or ''
+      if self.trace_file:
+        try:
+          self.trace = TraceRecorder(os.path.expanduser(self.trace_file))
+        except EnvironmentError:
+          self.trace = None
+
+  def close_trace(self):
+    for doc, handler_ids in self.traced:
+      for handler_id in handler_ids:
+        doc.disconnect(handler_id)
+    self.traced = []
+    if self.trace is not None:
+      self.trace.close()
+      self.trace = None
+
+  def trace_document(self, doc):
+    """Starts recording the edits of the document to the trace file (if
+       any), unless they are already recorded
+    """
+    trace = self.trace
+    if trace is None or trace.is_recorded(GeditBuffer.get(doc)):
+      return
+    tab = gedit.tab_get_from_document(doc)
+    trace.open(GeditBuffer.get(doc), tab.get_toplevel() if tab else None)
+    self.traced.append((doc, (
+      doc.connect('insert-text', self.on_trace_insert_text),
+      doc.connect('delete-range', self.on_trace_delete_range),
+    )))
+
+  def untrace_document(self, doc):
+    for entry in self.traced:
+      if entry[0] is doc:
+        for handler_id in entry[1]:
+          doc.disconnect(handler_id)
+        self.traced.remove(entry)
+        self.trace.record_close(GeditBuffer.get(doc))
+        break
+
+  def pause_trace(self, paused):
+    # The edits of the autocompleter are made again when the trace is
+    # replayed
+    if self.trace is not None:
+      self.trace.paused = paused
+
+  def record_settings(self):
+    if self.trace is not None:
+      self.trace.record_settings(scope=self.scope, order=self.order,
+        promote=self.promote_last_accepted, fuzzy=self.fuzzy,
+        smart_case=self.smart_case,
+        preview=self.preview, project=self.project_root
+        if self.scope == 'project' else None)
+
+  def on_trace_insert_text(self, doc, location, text, length):
+    self.trace.record_insert(GeditBuffer.get(doc),
+      (location.get_line(), location.get_line_offset()), text)
+
+  def on_trace_delete_range(self, doc, start, end):
+    self.trace.record_delete(GeditBuffer.get(doc),
+      (start.get_line(), start.get_line_offset()),
+      (end.get_line(), end.get_line_offset()))
+
+  def dump_statistics(self):
+    """Writes the trigger statistics (if any) to the stats file, or to the
+       log if there is no stats file
+    """
+    if self.statistics is None or not self.statistics.triggers:
+      return
+    if self.stats_file:
+      try:
+        stream = open(os.path.expanduser(self.stats_file), 'w')
+        try:
+          self.statistics.dump(stream)
+        finally:
+          stream.close()
+        return
+      except (IOError, OSError):
+        pass
+    self.statistics.dump(sys.stderr)
+
   def set_trigger(self, trigger):
     if isinstance(trigger, str):
       try:
@@ -359,9 +727,11 @@ class AutoCompletionPlugin(gedit.Plugin):
     self.gconf_configure(self.gconf_client)
 
   def gconf_deactivate(self):
+    if self.gconf_client is None:
+      return
     self.gconf_client.notify_remove(self.notify_id)
     del self.notify_id
-    del self.gconf_client
+    self.gconf_client = None
 
   def gconf_key_for(self, name):
     return '/'.join([self.ConfigRoot, name])
@@ -375,10 +745,26 @@ class AutoCompletionPlugin(gedit.Plugin):
       key = self.gconf_key_for(name)
       if client.get(key) is None:
         client.set_bool(key, value)
+    def set_int_default(name, value):
+      key = self.gconf_key_for(name)
+      if client.get(key) is None:
+        client.set_int(key, value)
     set_string_default('scope', self.scope)
     set_string_default('order', self.order)
     set_string_default('trigger', self.get_trigger_name())
     set_bool_default('promote', self.promote_last_accepted)
+    set_bool_default('fuzzy', self.fuzzy)
+    set_bool_default('smart_case', self.smart_case)
+    set_bool_default('preview', self.preview)
+    set_bool_default('instrument', self.statistics is not None)
+    set_string_default('stats_file', self.stats_file)
+    set_string_default('trace_file', self.trace_file)
+    set_int_default('memory_limit', self.get_memory_limit())
+    set_int_default('scan_lines', self.budget.lines or 0)
+    set_int_default('scan_time', int(round((self.budget.seconds or 0) * 1000)))
+    set_string_default('project_root', self.project_root)
+    set_string_default('project_ignore', self.project_ignore)
+    set_string_default('word_lists_dir', self.word_lists_dir)
     client.suggest_sync()
 
   def gconf_configure(self, client):
@@ -387,10 +773,24 @@ class AutoCompletionPlugin(gedit.Plugin):
       return value if value is not None else default
     def get_bool(name):
       return client.get_bool(self.gconf_key_for(name))
+    def get_int(name):
+      return client.get_int(self.gconf_key_for(name))
     self.set_scope(get_string('scope'))
     self.set_order(get_string('order'))
     self.set_trigger(get_string('trigger'))
     self.set_promote_last_accepted(get_bool('promote'))
+    self.set_fuzzy(get_bool('fuzzy'))
+    self.set_smart_case(get_bool('smart_case'))
+    self.set_preview(get_bool('preview'))
+    self.set_instrument(get_bool('instrument'))
+    self.set_stats_file(get_string('stats_file'))
+    self.set_trace_file(get_string('trace_file'))
+    self.set_memory_limit(get_int('memory_limit'))
+    self.set_scan_lines(get_int('scan_lines'))
+    self.set_scan_time(get_int('scan_time'))
+    self.set_project_root(get_string('project_root'))
+    self.set_project_ignore(get_string('project_ignore'))
+    self.set_word_lists_dir(get_string('word_lists_dir'))
 
   def gconf_event(self, client, cnxn_id, entry, user_data):
     key, value = entry.get_key(), entry.get_value()
@@ -401,13 +801,38 @@ class AutoCompletionPlugin(gedit.Plugin):
       self.set_order(value.get_string())
     elif name == 'promote' and value is not None:
       self.set_promote_last_accepted(value.get_bool())
+    elif name == 'fuzzy' and value is not None:
+      self.set_fuzzy(value.get_bool())
+    elif name == 'smart_case' and value is not None:
+      self.set_smart_case(value.get_bool())
+    elif name == 'preview' and value is not None:
+      self.set_preview(value.get_bool())
     elif name == 'trigger' and value is not None:
       self.set_trigger(value.get_string())
+    elif name == 'instrument' and value is not None:
+      self.set_instrument(value.get_bool())
+    elif name == 'stats_file' and value is not None:
+      self.set_stats_file(value.get_string())
+    elif name == 'trace_file' and value is not None:
+      self.set_trace_file(value.get_string())
+    elif name == 'memory_limit' and value is not None:
+      self.set_memory_limit(value.get_int())
+    elif name == 'scan_lines' and value is not None:
+      self.set_scan_lines(value.get_int())
+    elif name == 'scan_time' and value is not None:
+      self.set_scan_time(value.get_int())
+    elif name == 'project_root' and value is not None:
+      self.set_project_root(value.get_string())
+    elif name == 'project_ignore' and value is not None:
+      self.set_project_ignore(value.get_string())
+    elif name == 'word_lists_dir' and value is not None:
+      self.set_word_lists_dir(value.get_string())
 
   def is_configurable(self):
     return True
 
   def create_configure_dialog(self):
+    self.configure()
     dialog = ConfigurationDialog(self.gconf_client,self.ConfigRoot)
     return dialog
 
@@ -420,13 +845,30 @@ class ConfigurationDialog(gtk.Dialog):
   ScopeFrameText = '<b>Autocomplete using words from:</b>'
   ScopeDocText = 'The current document only'
   ScopeWinText = 'All open documents in the current window'
-  ScopeAppText = 'All open documents in the application'
+  ScopeAppText = 'All open and recently closed documents'
+  ScopeProjectText = 'All open documents and the files in the project folder'
+  ProjectRootKey = 'project_root'
+  ProjectRootTitle = 'Select the project folder'
   OrderKey = 'order'
   OrderFrameText = '<b>Sort autocompletion list:</b>'
   OrderAlphaText = 'In alphabetical order'
   OrderProximityText = 'Based on distance from cursor'
   PromoteKey = 'promote'
-  PromoteLastText = 'Promote last accepted match'
+  PromoteLastText = 'Promote frequently accepted matches'
+  FuzzyKey = 'fuzzy'
+  FuzzyText = 'Also offer the words the typed text abbreviates'
+  SmartCaseKey = 'smart_case'
+  SmartCaseText = 'Ignore case unless the typed text has capitals'
+  PreviewKey = 'preview'
+  PreviewText = 'Preview completions, inserting one once it is accepted'
+  ScanFrameText = '<b>Large documents:</b>'
+  ScanLinesKey = 'scan_lines'
+  ScanLinesText = 'Lines searched around the cursor (0 for all):'
+  ScanTimeKey = 'scan_time'
+  ScanTimeText = 'Time limit per completion in ms (0 for none):'
+  WordListsKey = 'word_lists_dir'
+  WordListsFrameText = '<b>Also autocomplete using the word lists in:</b>'
+  WordListsTitle = 'Select the word lists folder'
 
   def __init__(self, gconf_client, config_root):
     gtk.Dialog.__init__(self, self.Title, None, gtk.DIALOG_DESTROY_WITH_PARENT)
@@ -455,6 +897,14 @@ class ConfigurationDialog(gtk.Dialog):
     btn1 = scope_radio(self.ScopeDocText, 'document')
     btn2 = scope_radio(self.ScopeWinText, 'window', btn1)
     btn3 = scope_radio(self.ScopeAppText, 'application', btn2)
+    btn4 = scope_radio(self.ScopeProjectText, 'project', btn3)
+    chooser = gtk.FileChooserButton(self.ProjectRootTitle)
+    chooser.set_action(gtk.FILE_CHOOSER_ACTION_SELECT_FOLDER)
+    project_root = self._gconf_get_string(self.ProjectRootKey)
+    if project_root:
+      chooser.set_filename(os.path.expanduser(project_root))
+    chooser.connect('selection-changed', self.project_root_change)
+    scope_box.pack_start(chooser)
     frame.add(scope_box)
     mainbox.pack_start(frame)
     # Order configuration
@@ -476,8 +926,55 @@ class ConfigurationDialog(gtk.Dialog):
     btn3.connect('toggled', self.promote_configuration_change, gconf_client)
     btn3.set_active(self._gconf_get_bool(self.PromoteKey))
     order_box.pack_start(btn3)
+    btn4 = gtk.CheckButton(self.FuzzyText)
+    btn4.connect('toggled', self.fuzzy_configuration_change, gconf_client)
+    btn4.set_active(self._gconf_get_bool(self.FuzzyKey))
+    order_box.pack_start(btn4)
+    btn5 = gtk.CheckButton(self.PreviewText)
+    btn5.connect('toggled', self.preview_configuration_change, gconf_client)
+    btn5.set_active(self._gconf_get_bool(self.PreviewKey))
+    order_box.pack_start(btn5)
+    btn6 = gtk.CheckButton(self.SmartCaseText)
+    btn6.connect('toggled', self.smart_case_configuration_change, gconf_client)
+    btn6.set_active(self._gconf_get_bool(self.SmartCaseKey))
+    order_box.pack_start(btn6)
     frame.add(order_box)
     mainbox.pack_start(frame)
+    # Scan budget configuration
+    frame = gtk.Frame(self.ScanFrameText)
+    frame.set_shadow_type(gtk.SHADOW_NONE)
+    frame.get_label_widget().set_use_markup(True)
+    scan_table = gtk.Table(2, 2)
+    scan_table.set_border_width(5)
+    scan_table.set_col_spacings(10)
+    def scan_spin(row, text, key, upper, step):
+      label = gtk.Label(text)
+      label.set_alignment(0, 0.5)
+      adjustment = gtk.Adjustment(self._gconf_get_int(key, 0), 0, upper, step)
+      spin = gtk.SpinButton(adjustment)
+      spin.connect('value-changed', self.scan_configuration_change, key)
+      scan_table.attach(label, 0, 1, row, row + 1)
+      scan_table.attach(spin, 1, 2, row, row + 1, gtk.SHRINK)
+      return spin
+    scan_spin(0, self.ScanLinesText, self.ScanLinesKey, 1 << 20, 256)
+    scan_spin(1, self.ScanTimeText, self.ScanTimeKey, 10000, 10)
+    frame.add(scan_table)
+    mainbox.pack_start(frame)
+    # Word lists configuration
+    frame = gtk.Frame(self.WordListsFrameText)
+    frame.set_shadow_type(gtk.SHADOW_NONE)
+    frame.get_label_widget().set_use_markup(True)
+    chooser = gtk.FileChooserButton(self.WordListsTitle)
+    chooser.set_action(gtk.FILE_CHOOSER_ACTION_SELECT_FOLDER)
+    word_lists_dir = self._gconf_get_string(self.WordListsKey)
+    if word_lists_dir:
+      chooser.set_filename(os.path.expanduser(word_lists_dir))
+    chooser.connect('selection-changed', self.word_lists_change)
+    chooser_box = gtk.VBox(False, 0)
+    chooser_box.set_border_width(5)
+    chooser_box.pack_start(chooser)
+    frame.add(chooser_box)
+    mainbox.pack_start(frame)
     # Autocompletion trigger
     frame = gtk.Frame()
     frame.set_shadow_type(gtk.SHADOW_NONE)
@@ -579,11 +1076,33 @@ class ConfigurationDialog(gtk.Dialog):
     value = self.gconf_client.get_bool(key)
     return value if value is not None else default
 
+  def _gconf_set_int(self, name, value):
+    key = '/'.join((self.config_root, name))
+    if self.gconf_client.get_int(key) != value:
+      self.gconf_client.set_int(key, value)
+      return True
+    return False
+
+  def _gconf_get_int(self, name, default=None):
+    key = '/'.join((self.config_root, name))
+    value = self.gconf_client.get_int(key)
+    return value if value is not None else default
+
   def scope_configuration_change(self, widget, data=None):
     scope = widget.get_data(self.ScopeKey)
     if scope is not None and scope in AutoCompleter.ValidScopes:
       self._gconf_set_string(self.ScopeKey, scope)
 
+  def project_root_change(self, widget, data=None):
+    project_root = widget.get_filename()
+    if project_root:
+      self._gconf_set_string(self.ProjectRootKey, project_root)
+
+  def word_lists_change(self, widget, data=None):
+    word_lists_dir = widget.get_filename()
+    if word_lists_dir:
+      self._gconf_set_string(self.WordListsKey, word_lists_dir)
+
   def order_configuration_change(self, widget, data=None):
     order = widget.get_data(self.OrderKey)
     if order is not None and order in AutoCompleter.ValidOrders:
@@ -592,4 +1111,16 @@ class ConfigurationDialog(gtk.Dialog):
   def promote_configuration_change(self, widget, data=None):
     self._gconf_set_bool(self.PromoteKey, widget.get_active())
 
+  def fuzzy_configuration_change(self, widget, data=None):
+    self._gconf_set_bool(self.FuzzyKey, widget.get_active())
+
+  def preview_configuration_change(self, widget, data=None):
+    self._gconf_set_bool(self.PreviewKey, widget.get_active())
+
+  def smart_case_configuration_change(self, widget, data=None):
+    self._gconf_set_bool(self.SmartCaseKey, widget.get_active())
+
+  def scan_configuration_change(self, widget, key):
+    self._gconf_set_int(key, widget.get_value_as_int())
+
 # ex:ts=2:sw=2:et:
@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+#
+# Benchmarks of the TextMate style autocompletion core over synthetic corpora.
+# Reports the time taken to index the documents, the memory held by their
+# indexes, and the latency of triggering and cycling through completions for
+# every completion order and search scope.
+#
+# Usage: python tm_autocomplete_bench.py [--sizes=1K,1M] [--documents=1,16]
+#   [--vocabulary=1000,50000] [--triggers=50] [--seed=0]
+#
+# Copyright © 2010, Kevin McGuinness <kevin.mcguinness@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#
+
+import os
+import sys
+import time
+import random
+import shutil
+import tempfile
+from optparse import OptionParser
+from tm_autocomplete_core import InMemoryBuffer, VocabularyCache, \
+  AutoCompleter, Statistics, ProjectIndex
+
+try:
+  import tracemalloc
+except ImportError:
+  tracemalloc = None
+
+try:
+  import resource
+except ImportError:
+  resource = None
+
+# Multipliers of the size suffixes accepted on the command line
+SIZE_UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30}
+
+# Text placed between the words of the synthetic documents
+SEPARATORS = [' ', ' ', ' ', ', ', '.', ' = ', '(', ') ', '; ', ' + ']
+
+def parse_size(text):
+  """Parses a size such as 100K or 10M into a number of bytes"""
+  text = text.strip().upper()
+  unit = SIZE_UNITS.get(text[-1:], 1)
+  if unit > 1:
+    text = text[:-1]
+  return int(float(text) * unit)
+
+def format_size(size):
+  for suffix in ('G', 'M', 'K'):
+    if size >= SIZE_UNITS[suffix] and size % SIZE_UNITS[suffix] == 0:
+      return '%d%s' % (size // SIZE_UNITS[suffix], suffix)
+  return str(size)
+
+def percentile(values, fraction):
+  """Returns the nearest rank percentile of the values"""
+  values = sorted(values)
+  if not values:
+    return 0.0
+  return values[min(int(fraction * len(values)), len(values) - 1)]
+
+def make_vocabulary(rng, size):
+  """Returns a list of size distinct identifiers"""
+  letters = 'abcdefghijklmnopqrstuvwxyz'
+  words = set()
+  while len(words) < size:
+    word = ''.join(rng.choice(letters) for i in range(rng.randint(3, 12)))
+    if rng.random() < 0.2:
+      word += '_' + ''.join(rng.choice(letters) for i in range(3))
+    words.add(word)
+  return sorted(words)
+
+def make_text(rng, size, vocabulary):
+  """Returns about size bytes of code like text. The first words of the
+     vocabulary are the most frequent ones.
+  """
+  lines, length, n = [], 0, len(vocabulary)
+  while length < size:
+    words = [vocabulary[int(n * rng.random() ** 3)]
+      for i in range(rng.randint(1, 12))]
+    line = ' ' * (2 * rng.randint(0, 4)) + words[0]
+    for word in words[1:]:
+      line += rng.choice(SEPARATORS) + word
+    lines.append(line)
+    length += len(line) + 1
+  return '\n'.join(lines)
+
+def make_corpus(rng, size, documents, vocabulary):
+  """Returns the given number of text buffers, holding size bytes in total"""
+  return [InMemoryBuffer(make_text(rng, max(size // documents, 1), vocabulary))
+    for i in range(documents)]
+
+def measure_index_memory(buffers):
+  """Returns the number of bytes allocated to index each buffer, or None if
+     memory use cannot be measured
+  """
+  if tracemalloc is not None:
+    cache, sizes = VocabularyCache(), []
+    tracemalloc.start()
+    try:
+      for buffer in buffers:
+        before = tracemalloc.get_traced_memory()[0]
+        cache.get_index(buffer)
+        sizes.append(tracemalloc.get_traced_memory()[0] - before)
+    finally:
+      tracemalloc.stop()
+      cache.drop_all()
+    return sizes
+  if resource is not None:
+    # Only the growth of the peak resident set size is known, share it out
+    cache = VocabularyCache()
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    for buffer in buffers:
+      cache.get_index(buffer)
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    cache.drop_all()
+    total = sum(buffer.get_line_count() for buffer in buffers) or 1
+    return [(after - before) * 1024 * buffer.get_line_count() // total
+      for buffer in buffers]
+  return None
+
+class Benchmark(object):
+  """Completion latency measurements over one corpus. For the project scope,
+     the documents other than the current one are written to the project
+     directory (if given) and only the current one is open.
+  """
+
+  def __init__(self, rng, buffers, vocabulary, windows, project_dir=None,
+    memory=False, fuzzy=False, smart_case=False):
+    self.rng = rng
+    self.fuzzy = fuzzy
+    self.smart_case = smart_case
+    self.buffers = buffers
+    self.vocabulary = vocabulary
+    # Documents are shared out between the windows
+    self.windows = [buffers[i::windows] for i in range(windows)]
+    self.cache = VocabularyCache()
+    self.index_times = []
+    for buffer in buffers:
+      start = time.time()
+      self.cache.get_index(buffer)
+      self.index_times.append(time.time() - start)
+    self.project = None
+    self.project_time = self.project_memory = None
+    if project_dir is not None:
+      for i, buffer in enumerate(buffers[1:]):
+        stream = open(os.path.join(project_dir, 'file%d.txt' % i), 'w')
+        try:
+          stream.write(buffer.get_all_text())
+        finally:
+          stream.close()
+      self.project = ProjectIndex(project_dir)
+      if memory and tracemalloc is not None:
+        tracemalloc.start()
+      start = time.time()
+      self.project.refresh()
+      self.project_time = time.time() - start
+      if memory and tracemalloc is not None:
+        self.project_memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+  def get_scope_documents(self, scope):
+    if scope == 'application':
+      return self.buffers
+    if scope == 'window':
+      return self.windows[0]
+    if scope == 'project':
+      return self.buffers[:1]
+    return []
+
+  def get_scope_buffers(self, scope):
+    """Returns the buffers searched in the given scope"""
+    if scope == 'document':
+      return self.buffers[:1]
+    return self.get_scope_documents(scope)
+
+  def trigger(self, order, scope, cycles, stats=None):
+    """Types the start of a random word on a random line of the current
+       document, then triggers autocompletion and cycles through the
+       completions. Returns the seconds taken by the trigger and by each
+       cycle. The costs of the triggers are recorded in stats (if given).
+    """
+    buffer, rng = self.buffers[0], self.rng
+    line = rng.randint(0, buffer.get_line_count() - 1)
+    column = len(buffer.get_lines_text(line, line))
+    word = rng.choice(self.vocabulary)
+    typed = ' ' + word[:rng.randint(1, 3)]
+    buffer.insert((line, column), typed)
+    buffer.place_cursor((line, column + len(typed)))
+    if stats is not None:
+      stats.begin_trigger()
+    start = time.time()
+    completer = AutoCompleter(buffer, scope, order, False, self.cache,
+      self.get_scope_documents, stats, self.project, None, self.fuzzy,
+      smart_case=self.smart_case)
+    if completer.has_completions():
+      completer.insert_next_completion()
+    times = [time.time() - start]
+    for i in range(cycles):
+      if stats is not None:
+        stats.end_trigger(len(completer.matches))
+        stats.begin_trigger()
+      start = time.time()
+      if completer.has_completions():
+        completer.insert_next_completion()
+      times.append(time.time() - start)
+    if stats is not None:
+      stats.end_trigger(len(completer.matches))
+    # Restore the document
+    buffer.delete((line, column), buffer.get_cursor())
+    return times
+
+  def run(self, order, scope, triggers, cycles, stats=None):
+    """Returns the trigger and cycle latencies of a number of triggers"""
+    trigger_times, cycle_times = [], []
+    for i in range(triggers):
+      times = self.trigger(order, scope, cycles, stats)
+      trigger_times.append(times[0])
+      cycle_times.extend(times[1:])
+    return trigger_times, cycle_times
+
+def format_latencies(times):
+  return '%7.2f %7.2f %7.2f' % tuple(1000 * value for value in (
+    percentile(times, 0.5), percentile(times, 0.95), max(times or [0])))
+
+def main(argv=None):
+  parser = OptionParser(usage='%prog [options]')
+  parser.add_option('--sizes', default='1K,100K,1M,10M',
+    help='total corpus sizes, such as 1K or 100M [%default]')
+  parser.add_option('--documents', default='1,16',
+    help='numbers of documents the corpus is split into [%default]')
+  parser.add_option('--vocabulary', default='1000,50000',
+    help='numbers of distinct words in the corpus [%default]')
+  parser.add_option('--windows', type='int', default=2,
+    help='number of windows the documents are shared out to [%default]')
+  parser.add_option('--triggers', type='int', default=50,
+    help='autocompletions triggered per configuration [%default]')
+  parser.add_option('--cycles', type='int', default=5,
+    help='completions cycled through per trigger [%default]')
+  parser.add_option('--seed', type='int', default=0,
+    help='random seed of the corpora and triggers [%default]')
+  parser.add_option('--no-memory', action='store_false', dest='memory',
+    default=True, help='do not measure the memory used by the indexes')
+  parser.add_option('--phases', action='store_true', default=False,
+    help='report the cost of each phase of the triggers')
+  parser.add_option('--no-project', action='store_false', dest='project',
+    default=True, help='do not benchmark the project scope')
+  parser.add_option('--fuzzy', action='store_true', default=False,
+    help='offer fuzzy matches after the prefix matches')
+  parser.add_option('--smart-case', action='store_true', default=False,
+    help='ignore case when the typed prefix is lower case')
+  options, args = parser.parse_args(argv)
+
+  sizes = [parse_size(size) for size in options.sizes.split(',')]
+  documents = [int(count) for count in options.documents.split(',')]
+  vocabularies = [parse_size(size) for size in options.vocabulary.split(',')]
+  print('%-5s %4s %6s %-12s %-11s %8s %9s  %-23s  %-23s' % ('size', 'docs',
+    'vocab', 'order', 'scope', 'index s', 'memory MB',
+    'trigger ms p50/p95/max', 'cycle ms p50/p95/max'))
+  for size in sizes:
+    for count in documents:
+      for words in vocabularies:
+        rng = random.Random('%d/%d/%d/%d' % (options.seed, size, count, words))
+        vocabulary = make_vocabulary(rng, words)
+        buffers = make_corpus(rng, size, count, vocabulary)
+        memory = options.memory and measure_index_memory(buffers) or None
+        project_dir = options.project and tempfile.mkdtemp() or None
+        try:
+          benchmark = Benchmark(rng, buffers, vocabulary, options.windows,
+            project_dir, options.memory, options.fuzzy, options.smart_case)
+        finally:
+          if project_dir is not None:
+            shutil.rmtree(project_dir)
+        scopes = [scope for scope in AutoCompleter.ValidScopes
+          if scope != 'project' or options.project]
+        for order in AutoCompleter.ValidOrders:
+          for scope in scopes:
+            searched = [buffers.index(buffer)
+              for buffer in benchmark.get_scope_buffers(scope)]
+            index_time = sum(benchmark.index_times[i] for i in searched)
+            size_in_memory = memory and sum(memory[i] for i in searched)
+            if scope == 'project':
+              index_time += benchmark.project_time
+              if benchmark.project_memory is not None:
+                size_in_memory += benchmark.project_memory
+            if memory is not None:
+              megabytes = '%9.1f' % (size_in_memory / 1e6)
+            else:
+              megabytes = '%9s' % '-'
+            stats = options.phases and Statistics() or None
+            trigger_times, cycle_times = benchmark.run(order, scope,
+              options.triggers, options.cycles, stats)
+            print('%-5s %4d %6s %-12s %-11s %8.2f %s  %s  %s' % (
+              format_size(size), count, format_size(words), order, scope,
+              index_time, megabytes, format_latencies(trigger_times),
+              format_latencies(cycle_times)))
+            if stats is not None:
+              for line in stats.format_report().splitlines():
+                print('    ' + line)
+            sys.stdout.flush()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
+
+# ex:ts=2:sw=2:et:
@@ -0,0 +1,2908 @@
+# -*- coding: utf-8 -*-
+#
+# Editor independent core of the TextMate style autocompletion plugin: the
+# document indexes and the matching, ordering and promotion of completions.
+# Documents are accessed through the TextBuffer interface, so the completion
+# logic can be run and measured outside of gedit.
+#
+# Copyright © 2010, Kevin McGuinness <kevin.mcguinness@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+# 
+#
+
+import os
+import re
+import sys
+import mmap
+import hashlib
+import fnmatch
+import multiprocessing
+import time
+import heapq
+import json
+import collections
+import itertools
+from array import array
+from bisect import bisect_left, bisect_right, insort
+
+# Splits text into the words that are indexed for autocompletion
+WORD_REGEX = re.compile(r'\w+')
+
+# Splits text into lines, as line breaks are counted by GtkTextBuffer
+LINE_REGEX = re.compile(r'\r\n|\r|\n')
+
+# Sorts after any character that can appear in a word
+MAX_CHAR = chr(255) if str is bytes else chr(sys.maxunicode)
+
+# Words are interned, so the indexes of all documents share them
+intern = sys.intern if hasattr(sys, 'intern') else intern
+
+
+class TextBuffer(object):
+  """Interface to the text of a document. Positions in the text are (line,
+     column) pairs, both counted from 0, where the column counts characters.
+
+     Observers added to the buffer are told about every change to its text:
+
+       observer.before_insert(buffer, line)
+         Text is about to be inserted on the given line
+       observer.after_insert(buffer, first, last)
+         Text was inserted, and now spans lines first to last
+       observer.before_delete(buffer, first, last, everything)
+         The text from line first to line last is about to be deleted, the
+         flag is true if the whole text is deleted
+       observer.after_delete(buffer, line)
+         Text was deleted, the line it was removed from is now joined
+  """
+
+  __slots__ = ()
+
+  def get_line_count(self):
+    """Returns the number of lines in the buffer (at least one)"""
+    raise NotImplementedError
+
+  def get_lines_text(self, first, last):
+    """Returns the text of the lines first to last (inclusive), without the
+       terminating line break.
+    """
+    raise NotImplementedError
+
+  def get_text(self, start, end):
+    """Returns the text between two positions"""
+    raise NotImplementedError
+
+  def get_cursor(self):
+    """Returns the position of the cursor"""
+    raise NotImplementedError
+
+  def place_cursor(self, position):
+    raise NotImplementedError
+
+  def insert(self, position, text):
+    raise NotImplementedError
+
+  def delete(self, start, end):
+    raise NotImplementedError
+
+  def begin_user_action(self):
+    pass
+
+  def end_user_action(self):
+    pass
+
+  def get_file(self):
+    """Returns the path of the file the text was loaded from, or None"""
+    return None
+
+  def get_language(self):
+    """Returns the id of the language the text is written in (such as
+       python), or None
+    """
+    return None
+
+  def is_modified(self):
+    """Returns true if the text differs from the file it was loaded from"""
+    return False
+
+  def add_observer(self, observer):
+    raise NotImplementedError
+
+  def remove_observer(self, observer):
+    raise NotImplementedError
+
+
+class InMemoryBuffer(TextBuffer):
+  """Text buffer held in a list of lines, with '\\n' line breaks. The text
+     may be given the path of the file it was loaded from and the id of its
+     language.
+  """
+
+  __slots__ = (
+    'lines',     # Text of each line, without the line break
+    'cursor',    # Position of the cursor
+    'observers', # Objects told about changes to the text
+    'path',      # Path of the file the text was loaded from (or None)
+    'modified',  # Whether the text was changed since it was loaded
+    'language',  # Id of the language of the text (or None)
+  )
+
+  def __init__(self, text='', path=None, language=None):
+    self.lines = text.split('\n')
+    self.cursor = (0, 0)
+    self.observers = []
+    self.path = path
+    self.modified = False
+    self.language = language
+
+  def get_line_count(self):
+    return len(self.lines)
+
+  def get_lines_text(self, first, last):
+    return '\n'.join(self.lines[first:last + 1])
+
+  def get_text(self, start, end):
+    (line1, column1), (line2, column2) = start, end
+    if line1 == line2:
+      return self.lines[line1][column1:column2]
+    lines = self.lines[line1:line2 + 1]
+    lines[0] = lines[0][column1:]
+    lines[-1] = lines[-1][:column2]
+    return '\n'.join(lines)
+
+  def get_all_text(self):
+    return '\n'.join(self.lines)
+
+  def get_cursor(self):
+    return self.cursor
+
+  def place_cursor(self, position):
+    self.cursor = position
+
+  def get_file(self):
+    return self.path
+
+  def get_language(self):
+    return self.language
+
+  def is_modified(self):
+    return self.modified
+
+  def insert(self, position, text):
+    line, column = position
+    for observer in list(self.observers):
+      observer.before_insert(self, line)
+    old = self.lines[line]
+    new = (old[:column] + text).split('\n')
+    end = (line + len(new) - 1, len(new[-1]))
+    new[-1] += old[column:]
+    self.lines[line:line + 1] = new
+    self.cursor = end
+    self.modified = True
+    for observer in list(self.observers):
+      observer.after_insert(self, line, end[0])
+
+  def delete(self, start, end):
+    (line1, column1), (line2, column2) = start, end
+    everything = start == (0, 0) and end == (len(self.lines) - 1,
+      len(self.lines[-1]))
+    for observer in list(self.observers):
+      observer.before_delete(self, line1, line2, everything)
+    joined = self.lines[line1][:column1] + self.lines[line2][column2:]
+    self.lines[line1:line2 + 1] = [joined]
+    self.cursor = start
+    self.modified = True
+    for observer in list(self.observers):
+      observer.after_delete(self, line1)
+
+  def add_observer(self, observer):
+    self.observers.append(observer)
+
+  def remove_observer(self, observer):
+    self.observers.remove(observer)
+
+
+def get_initials(word):
+  """Returns the lower case initials of the parts of a snake_case or
+     camelCase word, such as 'gcdw' for get_current_doc_words
+  """
+  initials, previous = [], ''
+  for ch in word:
+    if ch.isalnum() and (not previous or previous == '_' or
+      (ch.isupper() and not previous.isupper()) or
+      (ch.isdigit() and not previous.isdigit())):
+      initials.append(ch.lower())
+    previous = ch
+  return ''.join(initials)
+
+def fold_key(word):
+  """Returns the sort key of a word in case insensitive searches: words are
+     sorted by their lower case form, then by spelling
+  """
+  return word.lower(), word
+
+def is_folded_match(word, prefix):
+  """Returns true if the word starts with the lower case prefix in any case,
+     and is not the prefix itself
+  """
+  return word[:len(prefix)].lower() == prefix and word != prefix
+
+def get_fuzzy_key(query, word):
+  """Returns the sort key of a fuzzy match of the lower case query with the
+     word, or None if they do not match. Words whose initials start with the
+     query come first, then words containing the characters of the query in
+     order, starting with the same character, the most compact match first.
+  """
+  if len(word) <= len(query):
+    return None
+  initials = get_initials(word)
+  if initials.startswith(query):
+    return (0, len(initials) - len(query), len(word), word)
+  lower = word.lower()
+  if lower[0] != query[0]:
+    return None
+  position = 0
+  for ch in query[1:]:
+    position = lower.find(ch, position + 1)
+    if position < 0:
+      return None
+  return (1, position + 1 - len(query), len(word), word)
+
+
+class FuzzyIndex(object):
+  """Index of a set of words for abbreviation and subsequence matching. The
+     words are kept sorted by their initials, so words with given initials
+     are found with a binary search. The words containing a character after
+     their first character are kept in posting lists, keyed by the first
+     character and the other one, so the words that may hold the characters
+     of a query are found by intersecting a few small lists.
+  """
+
+  __slots__ = (
+    'initials',  # Sorted list of (initials, word)
+    'postings',  # First and other character -> set of words
+  )
+
+  def __init__(self, words=()):
+    self.postings = {}
+    initials = []
+    for word in words:
+      initials.append((get_initials(word), word))
+      self._add_postings(word)
+    initials.sort()
+    self.initials = initials
+
+  def _add_postings(self, word):
+    lower = word.lower()
+    for ch in set(lower[1:]):
+      key = lower[0] + ch
+      postings = self.postings.get(key)
+      if postings is None:
+        postings = self.postings[key] = set()
+      postings.add(word)
+
+  def add(self, word):
+    insort(self.initials, (get_initials(word), word))
+    self._add_postings(word)
+
+  def remove(self, word):
+    key = (get_initials(word), word)
+    i = bisect_left(self.initials, key)
+    if i < len(self.initials) and self.initials[i] == key:
+      del self.initials[i]
+    lower = word.lower()
+    for ch in set(lower[1:]):
+      postings = self.postings.get(lower[0] + ch)
+      if postings is not None:
+        postings.discard(word)
+        if not postings:
+          del self.postings[lower[0] + ch]
+
+  def search(self, query):
+    """Returns the words that match the query (see get_fuzzy_key), the best
+       matches first
+    """
+    query = query.lower()
+    if len(query) < 2:
+      return []
+    found = set()
+    lo = bisect_left(self.initials, (query,))
+    hi = bisect_left(self.initials, (query + MAX_CHAR,), lo)
+    found.update(word for initials, word in self.initials[lo:hi])
+    postings = [self.postings.get(query[0] + ch, ()) for ch in set(query[1:])]
+    postings.sort(key=len)
+    if postings[0]:
+      found.update(set(postings[0]).intersection(*postings[1:]))
+    keys = [get_fuzzy_key(query, word) for word in found]
+    return [key[-1] for key in sorted(key for key in keys if key is not None)]
+
+
+class FoldedIndex(object):
+  """Case folded index of a set of words, for case insensitive searches. The
+     words are kept sorted by their lower case form (see fold_key), so the
+     words that start with a lower case prefix in any case are found with a
+     binary search, and are returned as spelt.
+  """
+
+  __slots__ = (
+    'keys',      # Sorted list of (lower case word, word)
+  )
+
+  def __init__(self, words=()):
+    self.keys = sorted(self._get_key(word) for word in words)
+
+  def _get_key(self, word):
+    # Lower case words share their string with their key
+    lower = word.lower()
+    return (word if lower == word else lower), word
+
+  def add(self, word):
+    insort(self.keys, self._get_key(word))
+
+  def remove(self, word):
+    key = self._get_key(word)
+    i = bisect_left(self.keys, key)
+    if i < len(self.keys) and self.keys[i] == key:
+      del self.keys[i]
+
+  def words_with_prefix(self, prefix):
+    """Returns an iterator of the words that start with the lower case
+       prefix in any case, other than the prefix itself, sorted by fold_key
+       (see iter_sorted)
+    """
+    return (word for key, word in iter_sorted(self.keys, (prefix,),
+      (prefix + MAX_CHAR,)) if word != prefix)
+
+
+class DocumentIndex(object):
+  """Vocabulary of a document, kept up to date from the changes reported by
+     its buffer. Only the lines touched by an edit are
+     tokenized again, so looking up completions does not rescan the document.
+     The words are also kept in a sorted list, so the completions of a prefix
+     are found with a binary search, and each word maps to the sorted labels
+     of the lines it occurs on, so its distance from the cursor is found with
+     a binary search too.
+
+     Each indexed line has a label, and the labels grow from the first line
+     to the last. Lines inserted are labelled between the labels of the
+     lines around them, so the occurrences of words on the other lines are
+     not renumbered. The labels are spaced out so this rarely runs out of
+     room; when it does, only the labels of the lines around the insertion
+     are spread out again (see _make_room). A label is mapped to the current
+     number of its line with a binary search, when a word is ranked.
+
+     The document is indexed in chunks of lines (see index_lines), from the
+     first line onwards. Edits made to lines that have not been indexed yet
+     are ignored, since the lines are tokenized when they are reached.
+
+     The words are interned, so the indexes of several documents share the
+     same strings, and the line labels are held in arrays of machine
+     integers rather than lists of integer objects.
+  """
+
+  # Lines an insertion after the last indexed line can add and still be
+  # indexed immediately
+  MaxInsertLines = 500
+
+  # Estimated bytes held per distinct word (dictionary entries, list slot
+  # and empty array), per occurrence and per line
+  WordSize = 200
+  OccurrenceSize = 4
+  LineSize = 4
+
+  # Difference between the labels of consecutive lines when they are given
+  # room, the least difference the labels of the lines around an insertion
+  # are spread out to when it runs out of room, and the largest label
+  LineSpacing = 1 << 10
+  MinSpacing = 1 << 6
+  MaxLabel = (1 << 31) - 1
+
+  __slots__ = (
+    'positions', # Sorted labels (array) of the lines each word occurs on
+    'total',     # Number of occurrences of all the words
+    'labels',    # Labels (array) of the lines indexed, in order
+    'words',     # Sorted list of the words in the document
+    'indexed',   # Number of lines indexed so far
+    'lines',     # Number of lines in the document
+    'schedule',  # Called with the document when it needs more indexing
+    'fuzzy',     # FuzzyIndex of the words, built when first searched
+    'folded',    # FoldedIndex of the words, built when first searched
+    'version',   # Number of changes made to the document
+    'edit_line', # Line the last run of edits was made to (None if several)
+    'edit_start', # Version the last run of edits to edit_line started from
+  )
+
+  def __init__(self, schedule=None):
+    self.schedule = schedule
+    self.version = 0
+    self.edit_line = None
+    self.edit_start = 0
+    self.clear()
+
+  def attach(self, doc):
+    """Starts tracking changes to the document (a TextBuffer). The document
+       is indexed by calling index_lines.
+    """
+    self.lines = doc.get_line_count()
+    doc.add_observer(self)
+
+  def detach(self, doc):
+    doc.remove_observer(self)
+    self.clear()
+
+  def clear(self):
+    self.positions = {}
+    self.total = 0
+    self.labels = array('i')
+    self.words = []
+    self.indexed = 0
+    self.fuzzy = None
+    self.folded = None
+
+  def is_complete(self):
+    """Returns true if every line of the document has been indexed"""
+    return self.indexed >= self.lines
+
+  def estimate_size(self):
+    """Returns an estimate of the bytes held by the index"""
+    return len(self.words) * self.WordSize + \
+      self.total * self.OccurrenceSize + len(self.labels) * self.LineSize
+
+  def index_lines(self, doc, count):
+    """Indexes up to count more lines of the document. Returns true once the
+       whole document has been indexed.
+    """
+    if self.indexed < self.lines:
+      first = self.indexed
+      last = min(first + count, self.lines) - 1
+      self._insert_labels(doc, first - 1, last - first + 1)
+      self.add_lines(doc.get_lines_text(first, last), first)
+      self.indexed = last + 1
+    return self.is_complete()
+
+  def load(self, words, counts, lines):
+    """Indexes the whole document at once, given the words in its text, the
+       number of occurrences of each and the labels of the lines they occur
+       on (see tokenize_lines, given LineSpacing). The index must be empty.
+    """
+    positions = self.positions
+    self.words = [intern(word) for word in words]
+    offset = 0
+    for word, count in zip(self.words, counts):
+      positions[word] = lines[offset:offset + count]
+      offset += count
+    self.total += offset
+    self.labels = array('i', range(0, self.lines * self.LineSpacing,
+      self.LineSpacing))
+    self.indexed = self.lines
+    # Searches made while the document was tokenized built these from the
+    # empty word list
+    self.fuzzy = None
+    self.folded = None
+
+  def _insert_labels(self, doc, first, count):
+    """Labels count lines inserted after the given indexed line (or before
+       the first line if first is -1). The document already holds them.
+    """
+    labels = self.labels
+    low = labels[first] if first >= 0 else -1
+    high = labels[first + 1] if first + 1 < len(labels) else \
+      self.MaxLabel + 1
+    step = min((high - low) // (count + 1), self.LineSpacing)
+    if step < 1:
+      low, step = self._make_room(doc, first, count)
+    labels[first + 1:first + 1] = array('i',
+      range(low + step, low + step * count + 1, step))
+
+  def _make_room(self, doc, first, count):
+    """Spreads out the labels of the lines around the given line, leaving
+       room for count labels after it. Returns the label of the line and the
+       step between the labels to insert.
+    """
+    labels = self.labels
+    size = 1
+    while True:
+      lo = max(first + 1 - size, 0)
+      hi = min(first + 1 + size, len(labels))
+      low = labels[lo - 1] if lo > 0 else -1
+      high = labels[hi] if hi < len(labels) else self.MaxLabel + 1
+      slots = hi - lo + count + 1
+      step = min((high - low) // slots, self.LineSpacing)
+      if step >= self.MinSpacing or lo == 0 and hi == len(labels):
+        break
+      size *= 2
+    if step < 1:
+      raise OverflowError('too many lines to label')
+    # The new labels of the lines from lo to hi (excluded), past the lines
+    # inserted after first
+    relabelled = dict((labels[i], low + step * (i - lo + 1 +
+      (count if i > first else 0))) for i in range(lo, hi))
+    if lo < hi:
+      # The words on those lines are the only ones to renumber
+      start, end = labels[lo], labels[hi - 1]
+      text = doc.get_lines_text(lo, first) if lo <= first else ''
+      if first + 1 < hi:
+        text += '\n' + doc.get_lines_text(first + 1 + count, hi - 1 + count)
+      for word in set(WORD_REGEX.findall(text)):
+        lines = self.positions.get(word)
+        if lines is not None:
+          i = bisect_left(lines, start)
+          j = bisect_right(lines, end, i)
+          lines[i:j] = array('i', [relabelled[label]
+            for label in lines[i:j]])
+      labels[lo:hi] = array('i', [relabelled[label]
+        for label in labels[lo:hi]])
+    return (labels[first] if first >= 0 else -1), step
+
+  def _get_line(self, label):
+    """Returns the current number of the line with the given label"""
+    return bisect_left(self.labels, label)
+
+  def add_lines(self, text, first):
+    """Indexes the words in the text, which starts at the given line. The
+       lines must be labelled.
+    """
+    positions, labels, words = self.positions, self.labels, self.words
+    for number, line in enumerate(LINE_REGEX.split(text), first):
+      label = labels[number]
+      for word in WORD_REGEX.findall(line):
+        lines = positions.get(word)
+        if lines is None:
+          word = intern(word)
+          lines = positions[word] = array('i')
+          insort(words, word)
+          if self.fuzzy is not None:
+            self.fuzzy.add(word)
+          if self.folded is not None:
+            self.folded.add(word)
+        if not lines or lines[-1] <= label:
+          lines.append(label)
+        else:
+          insort(lines, label)
+        self.total += 1
+
+  def remove_lines(self, text, first):
+    """Removes the words in the text, which starts at the given line"""
+    positions, labels, words = self.positions, self.labels, self.words
+    for number, line in enumerate(LINE_REGEX.split(text), first):
+      label = labels[number]
+      for word in WORD_REGEX.findall(line):
+        lines = positions.get(word)
+        if lines is None:
+          continue
+        i = bisect_left(lines, label)
+        if i < len(lines) and lines[i] == label:
+          del lines[i]
+          self.total -= 1
+        if not lines:
+          del positions[word]
+          del words[bisect_left(words, word)]
+          if self.fuzzy is not None:
+            self.fuzzy.remove(word)
+          if self.folded is not None:
+            self.folded.remove(word)
+
+  def count(self, word):
+    """Returns the number of occurrences of the word"""
+    return len(self.positions.get(word, ()))
+
+  def distance(self, word, line):
+    """Returns the number of lines between the given line and the nearest
+       occurrence of the word, along with a flag that is true if the nearest
+       occurrence comes after the line. Returns None if the word does not
+       occur in the document.
+    """
+    lines = self.positions.get(word)
+    if not lines:
+      return None
+    labels = self.labels
+    i = bisect_left(lines, labels[line]) if line < len(labels) else len(lines)
+    if i == len(lines):
+      return line - self._get_line(lines[-1]), False
+    after = self._get_line(lines[i]) - line
+    if i == 0:
+      return after, True
+    before = line - self._get_line(lines[i - 1])
+    if after < before:
+      return after, True
+    return before, False
+
+  def words_with_prefix(self, prefix, ignore_case=False):
+    """Returns an iterator of the indexed words that start with (and are
+       longer than) the given prefix, in order. The words are only read as
+       they are needed (see iter_sorted). If ignore_case is true, the words
+       that start with the lower case prefix in any case are returned
+       instead, sorted by fold_key.
+    """
+    if ignore_case:
+      if self.folded is None:
+        self.folded = FoldedIndex(self.words)
+      return self.folded.words_with_prefix(prefix)
+    return iter_sorted(self.words, prefix, prefix + MAX_CHAR)
+
+  def fuzzy_search(self, query):
+    """Returns the indexed words that match the query (see FuzzyIndex), the
+       best matches first
+    """
+    if self.fuzzy is None:
+      self.fuzzy = FuzzyIndex(self.words)
+    return self.fuzzy.search(query)
+
+  def _changed(self, first, last):
+    """Counts a change to the lines first to last"""
+    if first != last or first != self.edit_line:
+      self.edit_line = first if first == last else None
+      self.edit_start = self.version
+    self.version += 1
+
+  def before_insert(self, doc, first):
+    # The line receiving the text is tokenized again once it is inserted
+    if first < self.indexed:
+      self.remove_lines(doc.get_lines_text(first, first), first)
+
+  def after_insert(self, doc, first, last):
+    self._changed(first, last)
+    self.lines += last - first
+    if first < self.indexed:
+      if self.indexed == first + 1 and last - first > self.MaxInsertLines:
+        # Large insertion at the end of the indexed lines (such as a document
+        # being loaded), leave it to background indexing
+        self.indexed = first
+        del self.labels[first:]
+        if self.schedule is not None:
+          self.schedule(doc)
+      else:
+        self._insert_labels(doc, first, last - first)
+        self.add_lines(doc.get_lines_text(first, last), first)
+        self.indexed += last - first
+
+  def before_delete(self, doc, first, last, everything):
+    self._changed(first, last if not everything else None)
+    if everything:
+      self.clear()
+      if self.schedule is not None:
+        self.schedule(doc)
+    elif first < self.indexed:
+      text = doc.get_lines_text(first, min(last, self.indexed - 1))
+      self.remove_lines(text, first)
+      del self.labels[first + 1:last + 1]
+      self.indexed = max(self.indexed - (last - first), first + 1)
+    self.lines -= last - first
+
+  def after_delete(self, doc, first):
+    if first < self.indexed:
+      self.add_lines(doc.get_lines_text(first, first), first)
+
+
+def array_to_bytes(values):
+  return values.tobytes() if hasattr(values, 'tobytes') else values.tostring()
+
+def array_from_bytes(typecode, data):
+  values = array(typecode)
+  if hasattr(values, 'frombytes'):
+    values.frombytes(data)
+  else:
+    values.fromstring(data)
+  return values
+
+def to_bytes(text):
+  """Encodes text (if needed) as stored in files"""
+  if isinstance(text, bytes):
+    return text
+  return text.encode('utf-8', 'surrogateescape')
+
+def from_bytes(data):
+  """Decodes text read from files"""
+  if str is bytes:
+    return data
+  return data.decode('utf-8', 'surrogateescape')
+
+
+def merge_words(streams, folded=False):
+  """Yields the words of the given sorted sequences in order, each word once.
+     The sequences are merged with a heap, so only the words yielded (and the
+     next one of each sequence) are read from them. If folded is true, the
+     sequences are sorted by fold_key.
+  """
+  if folded:
+    streams = [((fold_key(word), word) for word in stream)
+      for stream in streams]
+  last = None
+  for word in heapq.merge(*streams):
+    if folded:
+      word = word[1]
+    if word != last:
+      last = word
+      yield word
+
+def iter_sorted(items, low, high):
+  """Yields the items of the sorted list that come after low and before
+     high, in order. The items are copied a batch at a time, as they are
+     needed, so the first ones are read without copying the others. The list
+     may change between batches: each batch starts after the last item
+     yielded.
+  """
+  start = bisect_right(items, low)
+  size = 16
+  while True:
+    batch = items[start:start + size]
+    for item in batch:
+      if item >= high:
+        return
+      yield item
+    if len(batch) < size:
+      return
+    start = bisect_right(items, batch[-1])
+    size = min(size * 4, 4096)
+
+
+class SortedWordFile(object):
+  """Sorted list of words held in a file, one per line after a header line.
+     The file is memory mapped and searched in place with a binary search, so
+     opening it costs nothing and only the pages searched are read.
+  """
+
+  __slots__ = (
+    'file',      # The open file
+    'data',      # Memory map of the file
+    'start',     # Offset of the first word
+    'header',    # Text of the header line
+  )
+
+  def __init__(self, filename):
+    self.file = open(filename, 'rb')
+    try:
+      self.data = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+    except:
+      self.file.close()
+      raise
+    self.start = self.data.find(b'\n') + 1
+    self.header = self.data[:self.start - 1]
+
+  @staticmethod
+  def write(filename, header, words):
+    """Writes the header and the sorted words to the file. The file is
+       replaced at once, so readers never see it half written.
+    """
+    temp = filename + '.tmp'
+    stream = open(temp, 'wb')
+    try:
+      stream.write(to_bytes(header) + b'\n')
+      for word in words:
+        stream.write(to_bytes(word) + b'\n')
+    finally:
+      stream.close()
+    os.rename(temp, filename)
+
+  def close(self):
+    self.data.close()
+    self.file.close()
+
+  def _find(self, key):
+    """Returns the offset of the first word not less than key"""
+    data, lo, hi = self.data, self.start, len(self.data)
+    while lo < hi:
+      mid = (lo + hi) // 2
+      # Every word (the one at lo included) follows a line break
+      start = data.rfind(b'\n', lo - 1, mid) + 1
+      end = data.find(b'\n', start)
+      if data[start:end] < key:
+        lo = end + 1
+      else:
+        hi = start
+    return lo
+
+  # Case variants of the start of a prefix searched for in case insensitive
+  # searches, the rest of the prefix is matched by filtering
+  MaxCaseVariants = 64
+
+  def words_with_prefix(self, prefix, ignore_case=False):
+    """Returns a sorted list of the words that start with (and are longer
+       than) the given prefix, or with the lower case prefix in any case
+       (see iter_words_with_prefix)
+    """
+    return list(self.iter_words_with_prefix(prefix, ignore_case))
+
+  def iter_words_with_prefix(self, prefix, ignore_case=False):
+    """Yields the words that start with (and are longer than) the given
+       prefix in order, reading them as they are needed. Stops early if the
+       file is closed meanwhile.
+
+       If ignore_case is true, the words that start with the lower case
+       prefix in any case (other than the prefix itself) are yielded in
+       fold_key order instead. The words are sorted as spelt, so the range of
+       each case variant of the start of the prefix is searched for, sorted
+       and the ranges are merged.
+    """
+    if not ignore_case:
+      return (from_bytes(word) for word in self._iter_words(to_bytes(prefix))
+        if len(word) > len(to_bytes(prefix)))
+    variants = ['']
+    for ch in prefix:
+      cases = set((ch, ch.upper()))
+      if len(variants) * len(cases) > self.MaxCaseVariants:
+        break
+      variants = [variant + case for variant in variants for case in cases]
+    words = merge_words([self._iter_folded_words(variant)
+      for variant in variants], True)
+    return (word for word in words if is_folded_match(word, prefix))
+
+  def _iter_folded_words(self, prefix):
+    """Yields the words that start with the given prefix in fold_key order"""
+    words = [from_bytes(word) for word in self._iter_words(to_bytes(prefix))]
+    words.sort(key=fold_key)
+    for word in words:
+      yield word
+
+  def _iter_words(self, key):
+    """Yields the words that start with the given bytes in order"""
+    try:
+      data, offset = self.data, self._find(key)
+      while offset < len(data):
+        end = data.find(b'\n', offset)
+        word = data[offset:end]
+        if not word.startswith(key):
+          break
+        yield word
+        offset = end + 1
+    except ValueError:
+      # The memory map was closed
+      return
+
+
+class VocabularyStore(object):
+  """Directory of SortedWordFiles holding the vocabularies of files. Each is
+     recorded with the modification time of its file, and is only used while
+     the file is unchanged. The vocabularies of the files saved or closed
+     last are kept, up to MaxFiles of them.
+  """
+
+  MaxFiles = 200
+  Magic = 'tm_autocomplete-1'
+
+  __slots__ = (
+    'directory', # Where the vocabularies are stored
+    'recent',    # Paths of the stored files, the last saved or closed last
+    'files',     # Path -> SortedWordFile opened for it
+  )
+
+  def __init__(self, directory):
+    self.directory = directory
+    self.recent = []
+    self.files = {}
+    try:
+      entries = []
+      for name in os.listdir(directory):
+        if name.endswith('.words'):
+          filename = os.path.join(directory, name)
+          stream = open(filename, 'rb')
+          try:
+            header = self._parse_header(stream.readline().rstrip(b'\n'))
+          finally:
+            stream.close()
+          if header is not None:
+            entries.append((os.path.getmtime(filename), header[1]))
+      self.recent = [path for mtime, path in sorted(entries)]
+    except EnvironmentError:
+      pass
+
+  def _get_filename(self, path):
+    digest = hashlib.md5(to_bytes(path)).hexdigest()
+    return os.path.join(self.directory, digest + '.words')
+
+  def _parse_header(self, header):
+    """Returns the (mtime, path) recorded in a header line, or None"""
+    fields = header.split(b' ', 2)
+    if len(fields) != 3 or fields[0] != to_bytes(self.Magic):
+      return None
+    return float(fields[1]), from_bytes(fields[2])
+
+  @staticmethod
+  def get_mtime(path):
+    try:
+      return os.stat(path).st_mtime
+    except EnvironmentError:
+      return None
+
+  def _set_recent(self, path):
+    if path in self.recent:
+      self.recent.remove(path)
+    self.recent.append(path)
+    while len(self.recent) > self.MaxFiles:
+      self.discard(self.recent[0])
+
+  def load(self, path):
+    """Returns the SortedWordFile of the file, or None if it is not stored
+       or has been modified since
+    """
+    mtime = self.get_mtime(path)
+    if mtime is None:
+      return None
+    words = self.files.get(path)
+    if words is None:
+      try:
+        words = self.files[path] = SortedWordFile(self._get_filename(path))
+      except (EnvironmentError, ValueError):
+        return None
+    header = self._parse_header(words.header)
+    if header is None or header != (mtime, path):
+      return None
+    return words
+
+  def prepare(self, path):
+    """Returns the name of the file the sorted words of the given file are
+       stored in and the header written before them (see SortedWordFile), or
+       None if they cannot be stored. Once written, they are recorded by
+       calling add, so they can be written by another process.
+    """
+    mtime = self.get_mtime(path)
+    if mtime is None or '\n' in path:
+      return None
+    try:
+      if not os.path.isdir(self.directory):
+        os.makedirs(self.directory)
+    except EnvironmentError:
+      return None
+    return self._get_filename(path), '%s %r %s' % (self.Magic, mtime, path)
+
+  def add(self, path):
+    """Records the sorted words of the file, once they are written"""
+    old = self.files.pop(path, None)
+    if old is not None:
+      old.close()
+    self._set_recent(path)
+
+  def save(self, path, words):
+    """Stores the sorted words of the file"""
+    target = self.prepare(path)
+    if target is None:
+      return
+    try:
+      SortedWordFile.write(target[0], target[1], words)
+    except EnvironmentError:
+      return
+    self.add(path)
+
+  def touch(self, path):
+    """Marks the stored file as the last one closed"""
+    if path in self.recent:
+      try:
+        os.utime(self._get_filename(path), None)
+      except EnvironmentError:
+        pass
+      self._set_recent(path)
+
+  def discard(self, path):
+    if path in self.recent:
+      self.recent.remove(path)
+    words = self.files.pop(path, None)
+    if words is not None:
+      words.close()
+    try:
+      os.remove(self._get_filename(path))
+    except EnvironmentError:
+      pass
+
+  def get_recent(self, exclude=(), limit=None):
+    """Returns the SortedWordFiles of the last files saved or closed (except
+       the given paths), the most recent first
+    """
+    result = []
+    for path in reversed(self.recent):
+      if limit is not None and len(result) >= limit:
+        break
+      if path not in exclude:
+        words = self.load(path)
+        if words is not None:
+          result.append(words)
+    return result
+
+  def close(self):
+    for words in self.files.values():
+      words.close()
+    self.files = {}
+
+
+def tokenize_lines(text, spacing=1):
+  """Returns the sorted words in the text, the number of occurrences of each
+     (an array), and the numbers of the lines they occur on times spacing,
+     word after word (an array).
+  """
+  positions = {}
+  for number, line in enumerate(LINE_REGEX.split(text)):
+    number *= spacing
+    for word in WORD_REGEX.findall(line):
+      lines = positions.get(word)
+      if lines is None:
+        lines = positions[word] = array('i')
+      lines.append(number)
+  words = sorted(positions)
+  counts, lines = array('i'), array('i')
+  for word in words:
+    counts.append(len(positions[word]))
+    lines.extend(positions[word])
+  return words, counts, lines
+
+def _tokenize_document(text):
+  # Runs in the worker processes of VocabularyCache. Packing the results
+  # makes them much quicker to send back than lists of strings and arrays.
+  words, counts, lines = tokenize_lines(text, DocumentIndex.LineSpacing)
+  return '\n'.join(words), array_to_bytes(counts), array_to_bytes(lines)
+
+def _unpack_tokens(tokens):
+  words, counts, lines = tokens
+  return words.split('\n') if words else [], array_from_bytes('i', counts), \
+    array_from_bytes('i', lines)
+
+def tokenize_file(path, max_size):
+  """Returns the sorted words of the file, or an empty list if it cannot be
+     read, is larger than max_size bytes or is not a text file. Runs in the
+     worker processes of ProjectIndex.
+  """
+  try:
+    stream = open(path, 'rb')
+    try:
+      data = stream.read(max_size + 1)
+    finally:
+      stream.close()
+  except EnvironmentError:
+    return []
+  if len(data) > max_size or b'\0' in data[:8192]:
+    return []
+  return sorted(set(WORD_REGEX.findall(from_bytes(data))))
+
+def _tokenize_project_file(args):
+  # Pool.map passes a single argument
+  return tokenize_file(*args)
+
+
+class ProjectIndex(object):
+  """Vocabulary of the files under a project directory. The files are
+     tokenized by a pool of worker processes, and refreshing the index only
+     tokenizes the files added or modified since the last refresh. Files and
+     directories whose name (or path relative to the root) matches one of
+     the ignore patterns are left out.
+
+     A refresh can run in the background: the project is scanned in idle
+     callbacks, registered with idle_add (see VocabularyCache), and the
+     changed files are tokenized in idle callbacks too if they are few and
+     small, or by the pool otherwise. Whether the workers are done is then
+     checked every PollInterval milliseconds from a callback registered with
+     timeout_add, and their results are applied once they are. Without
+     idle_add, poll does the work instead.
+  """
+
+  DefaultIgnore = ('.* *~ *.pyc *.pyo *.o *.so *.a *.class *.jar *.zip *.gz '
+    '*.bz2 *.xz *.tar *.png *.jpg *.gif *.ico *.pdf CVS build dist '
+    'node_modules')
+
+  # Largest file tokenized, and the number of files worth starting a pool of
+  # worker processes for
+  MaxFileSize = 4 << 20
+  MinPoolFiles = 16
+
+  # Largest file tokenized in an idle callback, and seconds spent scanning
+  # and tokenizing per idle callback
+  MaxIdleFileSize = 64 << 10
+  IdleSlice = 0.02
+
+  # Milliseconds between checks of whether the workers are done
+  PollInterval = 100
+
+  __slots__ = (
+    'root',      # The project directory
+    'ignore',    # List of the patterns of the names left out
+    'processes', # Number of worker processes (None for one per CPU)
+    'files',     # Path -> (mtime, sorted words) of the files indexed
+    'counts',    # Word -> number of files it occurs in
+    'words',     # Sorted list of the words in the files
+    'scanning',  # Iterator of the files of the scan in progress (or None)
+    'scanned',   # Path -> (mtime, size) of the files scanned so far
+    'queue',     # Changed files left to tokenize in idle callbacks
+    'pool',      # Worker processes of the refresh in progress
+    'pending',   # (paths, mtimes, result) of the refresh in progress
+    'refreshed', # Time the last refresh was started
+    'fuzzy',     # FuzzyIndex of the words, built when first searched
+    'folded',    # FoldedIndex of the words, built when first searched
+    'version',   # Number of times the words were updated
+    'idle_add',  # Registers an idle callback (None to work in poll)
+    'source_remove', # Unregisters an idle or timeout callback
+    'idle_id',   # Source id of the idle callback (None if not registered)
+    'timeout_add', # Registers a timeout callback polling the workers
+    'poll_id',   # Source id of the timeout callback (None if not registered)
+  )
+
+  def __init__(self, root, ignore=DefaultIgnore, processes=None,
+    idle_add=None, source_remove=None, timeout_add=None):
+    self.root = root
+    self.ignore = ignore.split() if isinstance(ignore, str) else list(ignore)
+    self.processes = processes
+    self.files = {}
+    self.counts = {}
+    self.words = []
+    self.scanning = None
+    self.scanned = {}
+    self.queue = []
+    self.pool = None
+    self.pending = None
+    self.refreshed = None
+    self.fuzzy = None
+    self.folded = None
+    self.version = 0
+    self.idle_add = idle_add
+    self.source_remove = source_remove
+    self.idle_id = None
+    self.timeout_add = timeout_add
+    self.poll_id = None
+
+  def is_ignored(self, name, path):
+    relative = os.path.relpath(path, self.root)
+    for pattern in self.ignore:
+      if fnmatch.fnmatch(name, pattern) or fnmatch.fnmatch(relative, pattern):
+        return True
+    return False
+
+  def _iter_files(self):
+    """Yields the path, modification time and size of each file in the
+       project
+    """
+    for dirpath, dirnames, filenames in os.walk(self.root):
+      dirnames[:] = [name for name in dirnames
+        if not self.is_ignored(name, os.path.join(dirpath, name))]
+      for name in filenames:
+        path = os.path.join(dirpath, name)
+        if not self.is_ignored(name, path):
+          try:
+            info = os.stat(path)
+          except EnvironmentError:
+            continue
+          yield path, info.st_mtime, info.st_size
+
+  def scan(self):
+    """Returns the modification time of each file in the project"""
+    return dict((path, mtime) for path, mtime, size in self._iter_files())
+
+  def is_refreshing(self):
+    return self.scanning is not None or bool(self.queue) or \
+      self.pending is not None
+
+  def refresh(self, wait=True):
+    """Brings the index up to date with the files in the project. Unless
+       wait is true, the refresh runs in the background (see poll). Returns
+       true once the index is up to date.
+    """
+    if not self.is_refreshing():
+      self.refreshed = time.time()
+      self.scanning = self._iter_files()
+      self.scanned = {}
+      if not wait and self.idle_add is not None:
+        self.idle_id = self.idle_add(self.on_idle)
+        return False
+    return self.poll(wait)
+
+  def poll(self, wait=False):
+    """Applies the results of the refresh in progress if the workers are
+       done (or once they are, if wait is true). The work left for idle
+       callbacks is done first if there are none, or if wait is true.
+       Returns true if no refresh is in progress anymore.
+    """
+    if self.idle_add is None or wait:
+      if self.scanning is not None:
+        self._scan()
+      while self.queue:
+        self._tokenize_next()
+    if self.pending is None:
+      return not self.is_refreshing()
+    paths, mtimes, result = self.pending
+    if not wait and not result.ready():
+      return False
+    try:
+      words = result.get()
+    except Exception:
+      words = [[] for path in paths]
+    for path, file_words in zip(paths, words):
+      self._add_file(path, mtimes[path], file_words)
+    self._set_words(sorted(self.counts))
+    self.close_pool()
+    return True
+
+  def on_idle(self):
+    deadline = time.time() + self.IdleSlice
+    if self.scanning is not None:
+      self._scan(deadline)
+    while self.queue:
+      self._tokenize_next()
+      if time.time() >= deadline:
+        break
+    if self.scanning is None and not self.queue:
+      self.idle_id = None
+      if self.pending is not None and self.timeout_add is not None:
+        self.poll_id = self.timeout_add(self.PollInterval, self.on_poll)
+    return self.idle_id is not None
+
+  def on_poll(self):
+    if self.poll():
+      self.poll_id = None
+    return self.poll_id is not None
+
+  def _scan(self, deadline=None):
+    """Scans the project until the given time (or to the end), then starts
+       tokenizing the changed files
+    """
+    scanned = self.scanned
+    for path, mtime, size in self.scanning:
+      scanned[path] = (mtime, size)
+      if deadline is not None and time.time() >= deadline:
+        return
+    self.scanning = None
+    removed = [path for path in self.files if path not in scanned]
+    for path in removed:
+      self._remove_file(path)
+    paths = [path for path, (mtime, size) in scanned.items()
+      if path not in self.files or self.files[path][0] != mtime]
+    if len(paths) < self.MinPoolFiles and (self.idle_add is None or
+      all(scanned[path][1] <= self.MaxIdleFileSize for path in paths)):
+      self.queue = paths
+      if not paths and removed:
+        self._set_words(sorted(self.counts))
+      return
+    processes = self.processes or multiprocessing.cpu_count()
+    self.pool = multiprocessing.Pool(processes)
+    chunksize = max(len(paths) // (4 * processes), 1)
+    result = self.pool.map_async(_tokenize_project_file,
+      [(path, self.MaxFileSize) for path in paths], chunksize)
+    mtimes = dict((path, scanned[path][0]) for path in paths)
+    self.pending = (paths, mtimes, result)
+
+  def _tokenize_next(self):
+    """Tokenizes the next changed file of the queue"""
+    path = self.queue.pop()
+    self._add_file(path, self.scanned[path][0],
+      tokenize_file(path, self.MaxFileSize))
+    if not self.queue:
+      self._set_words(sorted(self.counts))
+
+  def close_pool(self):
+    """Stops the workers tokenizing files (if any)"""
+    if self.pool is not None:
+      self.pool.terminate()
+      self.pool.join()
+    self.pool = None
+    self.pending = None
+
+  def close(self):
+    """Stops the refresh in progress (if any)"""
+    self.close_pool()
+    self.scanning = None
+    self.queue = []
+    if self.idle_id is not None:
+      self.source_remove(self.idle_id)
+      self.idle_id = None
+    if self.poll_id is not None:
+      self.source_remove(self.poll_id)
+      self.poll_id = None
+
+  def _set_words(self, words):
+    self.words = words
+    self.fuzzy = None
+    self.folded = None
+    self.version += 1
+
+  def _add_file(self, path, mtime, words):
+    self._remove_file(path)
+    words = [intern(word) for word in words]
+    self.files[path] = (mtime, words)
+    counts = self.counts
+    for word in words:
+      counts[word] = counts.get(word, 0) + 1
+
+  def _remove_file(self, path):
+    mtime, words = self.files.pop(path, (None, ()))
+    counts = self.counts
+    for word in words:
+      if counts[word] == 1:
+        del counts[word]
+      else:
+        counts[word] -= 1
+
+  def words_with_prefix(self, prefix, ignore_case=False):
+    """Returns an iterator of the words in the project that start with (and
+       are longer than) the given prefix, or with the lower case prefix in
+       any case (see DocumentIndex.words_with_prefix).
+    """
+    if ignore_case:
+      if self.folded is None:
+        self.folded = FoldedIndex(self.words)
+      return self.folded.words_with_prefix(prefix)
+    return iter_sorted(self.words, prefix, prefix + MAX_CHAR)
+
+  def fuzzy_search(self, query):
+    """Returns the words in the project that match the query (see
+       FuzzyIndex), the best matches first
+    """
+    if self.fuzzy is None:
+      self.fuzzy = FuzzyIndex(self.words)
+    return self.fuzzy.search(query)
+
+
+def _store_word_list(args):
+  # Runs in the worker processes of WordLists
+  path, filename, header, max_size = args
+  try:
+    SortedWordFile.write(filename, header, tokenize_file(path, max_size))
+  except EnvironmentError:
+    return False
+  return True
+
+
+class WordLists(object):
+  """Static lists of words offered as completions, such as the keywords of a
+     language, the symbols of an API or a dictionary. The lists are text files
+     in subdirectories of a directory: those in the subdirectory named after
+     the id of a language (such as python) are searched in documents in that
+     language, those in the subdirectory named all in every document.
+
+     Nothing is read until a list is first searched. Its words are then
+     sorted and kept in a VocabularyStore (until the list is modified), so
+     the list is memory mapped and searched in place, and only the pages
+     searched are read. Lists whose words cannot be stored are left out.
+
+     The words of the lists are sorted by a pool of worker processes, which
+     write them to the store, and a list is left out until they are. Whether
+     the workers are done is checked every PollInterval milliseconds, from a
+     callback registered with timeout_add (given the interval and the
+     callback, and returning a source id for source_remove). Without
+     timeout_add, the words of a list are sorted as soon as it is searched.
+  """
+
+  AllLanguages = 'all'
+
+  # Largest list read
+  MaxFileSize = 64 << 20
+
+  # Milliseconds between checks of whether the workers are done
+  PollInterval = 100
+
+  __slots__ = (
+    'directory', # Directory of the lists
+    'store_dir', # Directory of the sorted words of the lists
+    'store',     # VocabularyStore of the sorted words, opened when needed
+    'lists',     # Subdirectory -> (mtime, paths of its lists)
+    'processes', # Number of worker processes (None for one per CPU)
+    'pool',      # Worker processes sorting lists
+    'pending',   # (paths, headers, result) of the lists being sorted
+    'failed',    # Path -> header of the lists that could not be stored
+    'timeout_add', # Registers a timeout callback (None to sort at once)
+    'source_remove', # Unregisters a timeout callback
+    'poll_id',   # Source id of the timeout callback (None if not registered)
+  )
+
+  def __init__(self, directory, store_dir, processes=None, timeout_add=None,
+    source_remove=None):
+    self.directory = directory
+    self.store_dir = store_dir
+    self.store = None
+    self.lists = {}
+    self.processes = processes
+    self.pool = None
+    self.pending = None
+    self.failed = {}
+    self.timeout_add = timeout_add
+    self.source_remove = source_remove
+    self.poll_id = None
+
+  def _get_lists(self, name):
+    """Returns the paths of the lists in the given subdirectory, listing it
+       again if it has changed
+    """
+    directory = os.path.join(self.directory, name)
+    mtime = VocabularyStore.get_mtime(directory)
+    if mtime is None:
+      self.lists.pop(name, None)
+      return []
+    entry = self.lists.get(name)
+    if entry is None or entry[0] != mtime:
+      try:
+        names = os.listdir(directory)
+      except EnvironmentError:
+        names = []
+      paths = [os.path.join(directory, filename) for filename in sorted(names)
+        if not filename.startswith('.')]
+      entry = self.lists[name] = (mtime, [path for path in paths
+        if os.path.isfile(path)])
+    return entry[1]
+
+  def _load(self, path):
+    """Returns the SortedWordFile of the list, or None if its words are not
+       stored. Without timeout_add, they are stored first if needed.
+    """
+    if self.store is None:
+      self.store = VocabularyStore(self.store_dir)
+    words = self.store.load(path)
+    if words is None and self.timeout_add is None:
+      self.store.save(path, tokenize_file(path, self.MaxFileSize))
+      words = self.store.load(path)
+    return words
+
+  def get_lists(self, language):
+    """Returns the SortedWordFiles of the lists searched in documents in the
+       given language (None if unknown). The lists whose words are not stored
+       yet are left out, and are sorted in the background.
+    """
+    names = [self.AllLanguages]
+    if language and language != self.AllLanguages:
+      names.insert(0, language)
+    self.poll()
+    result, unsorted = [], []
+    for name in names:
+      for path in self._get_lists(name):
+        words = self._load(path)
+        if words is not None:
+          result.append(words)
+        else:
+          unsorted.append(path)
+    if unsorted and self.pending is None and self.timeout_add is not None:
+      self._sort(unsorted)
+    return result
+
+  def _sort(self, paths):
+    """Starts sorting the words of the given lists in worker processes, which
+       write them to the store
+    """
+    tasks = []
+    for path in paths:
+      target = self.store.prepare(path)
+      if target is not None and self.failed.get(path) != target[1]:
+        tasks.append((path,) + target + (self.MaxFileSize,))
+    if not tasks:
+      return
+    processes = min(self.processes or multiprocessing.cpu_count(), len(tasks))
+    self.pool = multiprocessing.Pool(processes)
+    result = self.pool.map_async(_store_word_list, tasks)
+    self.pending = ([task[0] for task in tasks], [task[2] for task in tasks],
+      result)
+    if self.poll_id is None:
+      self.poll_id = self.timeout_add(self.PollInterval, self.on_poll)
+
+  def poll(self):
+    """Records the lists sorted by the workers if they are done. Returns true
+       if no lists are being sorted anymore.
+    """
+    if self.pending is None:
+      return True
+    paths, headers, result = self.pending
+    if not result.ready():
+      return False
+    try:
+      stored = result.get()
+    except Exception:
+      stored = [False] * len(paths)
+    self.close_pool()
+    for path, header, ok in zip(paths, headers, stored):
+      if ok:
+        self.store.add(path)
+      else:
+        # Not tried again until the list is modified
+        self.failed[path] = header
+    return True
+
+  def on_poll(self):
+    if self.poll():
+      self.poll_id = None
+    return self.poll_id is not None
+
+  def close_pool(self):
+    """Stops the workers sorting lists (if any)"""
+    if self.pool is not None:
+      self.pool.terminate()
+      self.pool.join()
+    self.pool = None
+    self.pending = None
+
+  def words_with_prefix(self, language, prefix, ignore_case=False):
+    """Returns the words in the lists searched in documents in the given
+       language that start with (and are longer than) the given prefix, as a
+       list of sorted iterators (see VocabularyCache.words_with_prefix)
+    """
+    return [words.iter_words_with_prefix(prefix, ignore_case)
+      for words in self.get_lists(language)]
+
+  def close(self):
+    self.close_pool()
+    if self.poll_id is not None:
+      self.source_remove(self.poll_id)
+      self.poll_id = None
+    if self.store is not None:
+      self.store.close()
+      self.store = None
+    self.lists = {}
+
+
+class VocabularyCache(object):
+  """Application wide cache of document indexes. An index is created the
+     first time its document is searched, is kept up to date as the document
+     is edited, and is dropped when the document is closed. Searching several
+     documents only merges the results of their indexes.
+
+     Documents are indexed in the background: idle callbacks index a few
+     chunks of lines at a time, so the main loop is never blocked for long.
+     The callbacks are registered with idle_add, which is given the callback
+     and returns a source id for source_remove. Without idle_add, documents
+     are indexed as soon as they are searched.
+
+     Given a VocabularyStore, the vocabulary of a file is stored once its
+     document is indexed, and is searched in place of the index until the
+     index is complete the next time the file is opened. The vocabularies of
+     the files closed last can be searched too.
+
+     Given a memory limit (in bytes), the indexes searched least recently are
+     evicted once the estimated size of all the indexes exceeds it. Their
+     vocabularies are stored, and they are indexed again when next searched.
+
+     When many documents that are not indexed yet are searched together (see
+     prefetch), snapshots of their text are tokenized by a pool of worker
+     processes instead. Whether the workers are done is checked every
+     PollInterval milliseconds, from a callback registered with timeout_add
+     (given the interval and the callback, and returning a source id for
+     source_remove), or else when documents are next searched. A document
+     edited before its results are loaded is indexed in chunks as usual.
+  """
+
+  # Lines indexed at a time, and seconds spent indexing per idle callback
+  ChunkLines = 500
+  IdleSlice = 0.02
+
+  # Numbers of documents and of bytes of text worth starting a pool of
+  # worker processes for
+  MinPoolDocuments = 8
+  MinPoolSize = 1 << 20
+
+  # Milliseconds between checks of whether the workers are done
+  PollInterval = 100
+
+  # Number of closed files searched
+  RecentFiles = 20
+
+  def __init__(self, idle_add=None, source_remove=None, store=None,
+    memory_limit=None, processes=None, timeout_add=None):
+    self.indexes = collections.OrderedDict()
+    self.memory_limit = memory_limit
+    self.processes = processes
+    self.pool = None
+    self.pending = None
+    self.queue = []
+    self.idle_id = None
+    self.idle_add = idle_add
+    self.source_remove = source_remove
+    self.poll_id = None
+    self.timeout_add = timeout_add
+    self.store = store
+    self.stored = {}
+
+  def get_index(self, doc):
+    """Returns the index of the document, which may not be complete yet. An
+       index that is not complete is scheduled for background indexing.
+    """
+    index = self.indexes.pop(doc, None)
+    if index is None:
+      index = DocumentIndex(self.schedule)
+      index.attach(doc)
+    # Keep the indexes in the order they were last searched
+    self.indexes[doc] = index
+    if not index.is_complete():
+      if self.idle_add is None:
+        while not index.index_lines(doc, self.ChunkLines):
+          pass
+        self.on_index_complete(doc)
+        self.limit_memory()
+      else:
+        self.schedule(doc)
+    return index
+
+  def estimate_size(self):
+    """Returns an estimate of the bytes held by the indexes"""
+    return sum(index.estimate_size() for index in self.indexes.values())
+
+  def limit_memory(self):
+    """Evicts the indexes searched least recently until the indexes fit in
+       the memory limit. The index searched last is always kept.
+    """
+    if not self.memory_limit:
+      return
+    size = self.estimate_size()
+    while size > self.memory_limit and len(self.indexes) > 1:
+      doc = next(iter(self.indexes))
+      size -= self.indexes[doc].estimate_size()
+      self.evict(doc)
+
+  def evict(self, doc):
+    """Drops the index of an open document, after storing its vocabulary.
+       The document is indexed again the next time it is searched.
+    """
+    if doc in self.queue:
+      self.queue.remove(doc)
+    self.stored.pop(doc, None)
+    self.save(doc)
+    # Only stop updating the index, it may still be in use by a search
+    doc.remove_observer(self.indexes.pop(doc))
+
+  def get_stored_words(self, doc):
+    """Returns the stored vocabulary (a SortedWordFile) of the file of the
+       document, if its index is not complete yet
+    """
+    if self.store is None or self.get_index(doc).is_complete():
+      return None
+    if doc not in self.stored:
+      path = doc.get_file()
+      self.stored[doc] = self.store.load(path) if path else None
+    return self.stored[doc]
+
+  def on_index_complete(self, doc):
+    self.stored.pop(doc, None)
+    self.save(doc)
+
+  def save(self, doc):
+    """Stores the vocabulary of the document, if it is fully indexed and
+       matches its file
+    """
+    path = doc.get_file()
+    if self.store is None or not path or doc.is_modified():
+      return
+    index = self.indexes.get(doc)
+    if index is not None and index.is_complete() and \
+      self.store.load(path) is None:
+      self.store.save(path, index.words)
+
+  def schedule(self, doc):
+    """Queues the document for background indexing"""
+    if self.idle_add is None:
+      # Indexed by get_index instead
+      return
+    if doc not in self.queue and not self.is_pending(doc):
+      self.queue.append(doc)
+    if self.idle_id is None:
+      self.idle_id = self.idle_add(self.on_idle)
+
+  def is_pending(self, doc):
+    """Returns true if the document is being tokenized by the pool"""
+    return self.pending is not None and doc in self.pending[0]
+
+  def prefetch(self, docs):
+    """Starts indexing the given documents. If enough of them have not been
+       indexed at all yet, they are tokenized by a pool of worker processes.
+       Without idle_add, the documents are indexed before returning.
+    """
+    self.poll(self.idle_add is None)
+    cold = [doc for doc in docs if not self.is_pending(doc) and
+      (doc not in self.indexes or self.indexes[doc].indexed == 0)]
+    texts = []
+    if len(cold) >= self.MinPoolDocuments:
+      texts = [doc.get_lines_text(0, doc.get_line_count() - 1)
+        for doc in cold]
+    if texts and sum(len(text) for text in texts) >= self.MinPoolSize:
+      indexes = []
+      for doc in cold:
+        index = self.indexes.pop(doc, None)
+        if index is None:
+          index = DocumentIndex(self.schedule)
+          index.attach(doc)
+        self.indexes[doc] = index
+        indexes.append(index)
+        if doc in self.queue:
+          self.queue.remove(doc)
+      processes = self.processes or multiprocessing.cpu_count()
+      self.pool = multiprocessing.Pool(processes)
+      chunksize = max(len(texts) // (4 * processes), 1)
+      result = self.pool.map_async(_tokenize_document, texts, chunksize)
+      versions = [index.version for index in indexes]
+      self.pending = (cold, indexes, versions, result)
+      if self.idle_add is None:
+        self.poll(True)
+      elif self.timeout_add is not None and self.poll_id is None:
+        self.poll_id = self.timeout_add(self.PollInterval, self.on_poll)
+    for doc in docs:
+      if not self.is_pending(doc):
+        self.get_index(doc)
+
+  def poll(self, wait=False):
+    """Loads the indexes tokenized by the pool if the workers are done (or
+       once they are, if wait is true). Returns true if no documents are
+       being tokenized anymore.
+    """
+    if self.pending is None:
+      return True
+    docs, indexes, versions, result = self.pending
+    if not wait and not result.ready():
+      return False
+    try:
+      tokens = result.get()
+    except Exception:
+      tokens = [None] * len(docs)
+    self.close_pool()
+    for doc, index, version, packed in zip(docs, indexes, versions, tokens):
+      if self.indexes.get(doc) is not index:
+        # Dropped or evicted meanwhile
+        continue
+      if packed is not None and index.version == version and \
+        index.indexed == 0:
+        index.load(*_unpack_tokens(packed))
+        self.on_index_complete(doc)
+      else:
+        self.schedule(doc)
+    self.limit_memory()
+    return True
+
+  def close_pool(self):
+    """Stops the workers tokenizing documents (if any)"""
+    if self.pool is not None:
+      self.pool.terminate()
+      self.pool.join()
+    self.pool = None
+    self.pending = None
+
+  def on_poll(self):
+    if self.poll():
+      self.poll_id = None
+    return self.poll_id is not None
+
+  def on_idle(self):
+    deadline = time.time() + self.IdleSlice
+    while self.queue:
+      doc = self.queue[0]
+      index = self.indexes.get(doc)
+      if index is None or index.index_lines(doc, self.ChunkLines):
+        self.queue.pop(0)
+        if index is not None:
+          self.on_index_complete(doc)
+      if time.time() >= deadline:
+        break
+    self.limit_memory()
+    if not self.queue:
+      self.idle_id = None
+    return self.idle_id is not None
+
+  def drop(self, doc):
+    """Stops maintaining the index of the document (if any)"""
+    if doc in self.queue:
+      self.queue.remove(doc)
+    self.stored.pop(doc, None)
+    if self.store is not None and doc in self.indexes:
+      self.save(doc)
+      path = doc.get_file()
+      if path:
+        self.store.touch(path)
+    index = self.indexes.pop(doc, None)
+    if index is not None:
+      index.detach(doc)
+
+  def drop_all(self):
+    self.close_pool()
+    for doc in list(self.indexes):
+      self.drop(doc)
+    if self.idle_id is not None:
+      self.source_remove(self.idle_id)
+      self.idle_id = None
+    if self.poll_id is not None:
+      self.source_remove(self.poll_id)
+      self.poll_id = None
+
+  def words_with_prefix(self, docs, prefix, ignore_case=False):
+    """Returns the words in the given documents that start with (and are
+       longer than) the given prefix, as a list of sorted iterators (one per
+       index or stored vocabulary) to be merged (see merge_words). The words
+       are only read from the indexes and the stored vocabularies as they are
+       needed. If ignore_case is true, the words that start with the lower
+       case prefix in any case are returned instead, sorted by fold_key.
+    """
+    words = []
+    for doc in docs:
+      words.append(self.get_index(doc).words_with_prefix(prefix, ignore_case))
+      stored = self.get_stored_words(doc)
+      if stored is not None:
+        words.append(stored.iter_words_with_prefix(prefix, ignore_case))
+    return words
+
+  def closed_words_with_prefix(self, docs, prefix, ignore_case=False):
+    """Returns the words in the files closed last (other than the files of
+       the given documents) that start with (and are longer than) the given
+       prefix, as a list of sorted iterators (see words_with_prefix).
+    """
+    words = []
+    if self.store is not None:
+      exclude = set(doc.get_file() for doc in docs)
+      for stored in self.store.get_recent(exclude, self.RecentFiles):
+        words.append(stored.iter_words_with_prefix(prefix, ignore_case))
+    return words
+
+  def fuzzy_words(self, docs, query):
+    """Returns the set of words in the given documents that match the query
+       (see FuzzyIndex)
+    """
+    words = set()
+    for doc in docs:
+      words.update(self.get_index(doc).fuzzy_search(query))
+    return words
+
+
+class TriggerStats(object):
+  """Costs of handling one autocompletion trigger"""
+
+  __slots__ = (
+    'start',     # Time the trigger was received
+    'phases',    # Phase name -> seconds spent in the phase
+    'counts',    # Counter name -> value
+    'documents', # Documents whose text or index was read
+  )
+
+  def __init__(self):
+    self.start = time.time()
+    self.phases = {}
+    self.counts = {}
+    self.documents = set()
+
+  def add_time(self, phase, seconds):
+    self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+  def add_count(self, name, value):
+    self.counts[name] = self.counts.get(name, 0) + value
+
+
+class Statistics(object):
+  """Rolling statistics of the autocompletion triggers. The time spent in
+     each phase of a trigger, the bytes of text read, the documents searched
+     and the candidates considered are recorded for the last WindowSize
+     triggers, and summarized as percentiles.
+
+     The phases are 'read' (getting text from the buffers), 'scan'
+     (tokenizing that text), 'lookup' (looking up words in the indexes),
+     'rank' (ordering the words), 'edit' (inserting the completion) and
+     'total' (the whole trigger). The times taken by the phases of the
+     startup of the plugin (such as 'activate') are reported the same way.
+  """
+
+  WindowSize = 1000
+  Percentiles = (0.5, 0.9, 0.99)
+
+  __slots__ = (
+    'samples',   # Metric name -> recent values, oldest first
+    'triggers',  # Number of triggers recorded
+    'current',   # TriggerStats of the trigger being handled (or None)
+  )
+
+  def __init__(self):
+    self.samples = {}
+    self.triggers = 0
+    self.current = None
+
+  def begin_trigger(self):
+    self.current = TriggerStats()
+    return self.current
+
+  def end_trigger(self, matches=0):
+    """Records the trigger being handled, along with the number of matches
+       the autocompleter has computed so far.
+    """
+    trigger, self.current = self.current, None
+    if trigger is None:
+      return
+    trigger.add_time('total', time.time() - trigger.start)
+    trigger.counts['documents'] = len(trigger.documents)
+    trigger.counts['matches'] = matches
+    for phase, seconds in trigger.phases.items():
+      self._add_sample(phase + ' ms', seconds * 1000)
+    for name, value in trigger.counts.items():
+      self._add_sample(name, value)
+    self.triggers += 1
+
+  def add_startup_time(self, phase, seconds):
+    self._add_sample(phase + ' ms', seconds * 1000)
+
+  def _add_sample(self, name, value):
+    samples = self.samples.get(name)
+    if samples is None:
+      samples = self.samples[name] = collections.deque(maxlen=self.WindowSize)
+    samples.append(value)
+
+  def get_percentiles(self, name):
+    """Returns the configured percentiles and the maximum of the recent
+       values of the metric
+    """
+    values = sorted(self.samples.get(name, ()))
+    if not values:
+      return [0] * (len(self.Percentiles) + 1)
+    n = len(values)
+    return [values[min(int(p * n), n - 1)] for p in self.Percentiles] + \
+      [values[-1]]
+
+  def format_report(self):
+    """Returns the statistics as a table, one metric per line"""
+    lines = ['%d autocompletion triggers, statistics of the last %d' % (
+      self.triggers, min(self.triggers, self.WindowSize))]
+    header = ['p%g' % (100 * p) for p in self.Percentiles] + ['max']
+    lines.append('%-12s' % 'metric' + ''.join('%12s' % h for h in header))
+    for name in sorted(self.samples):
+      values = self.get_percentiles(name)
+      lines.append('%-12s' % name + ''.join('%12.2f' % v for v in values))
+    return '\n'.join(lines) + '\n'
+
+  def dump(self, stream):
+    stream.write(self.format_report())
+    stream.flush()
+
+
+class AcceptHistory(object):
+  """Bounded record of the completions accepted, used to offer the ones
+     accepted often and recently first. The score of a word grows by one
+     each time it is accepted, and decays by a factor of Decay each time any
+     completion is accepted. Only the MaxWords words accepted last are kept.
+  """
+
+  MaxWords = 1000
+  Decay = 0.9
+
+  __slots__ = (
+    'entries',   # Word -> (score, clock when scored), last accepted last
+    'clock',     # Number of completions accepted
+  )
+
+  def __init__(self):
+    self.entries = collections.OrderedDict()
+    self.clock = 0
+
+  def __len__(self):
+    return len(self.entries)
+
+  def accept(self, word):
+    self.clock += 1
+    score = self.score(word) + 1
+    self.entries.pop(word, None)
+    self.entries[word] = (score, self.clock)
+    if len(self.entries) > self.MaxWords:
+      self.entries.popitem(last=False)
+
+  def score(self, word):
+    """Returns the current score of the word (0 if it was not accepted)"""
+    entry = self.entries.get(word)
+    if entry is None:
+      return 0.0
+    score, clock = entry
+    return score * self.Decay ** (self.clock - clock)
+
+  def last(self):
+    """Returns the word accepted last, or None"""
+    return next(reversed(self.entries)) if self.entries else None
+
+  def words_with_prefix(self, prefix, ignore_case=False):
+    """Returns the accepted words that start with (and are longer than) the
+       given prefix, or with the lower case prefix in any case, the highest
+       scoring first
+    """
+    n = len(prefix)
+    if ignore_case:
+      words = [word for word in self.entries if is_folded_match(word, prefix)]
+    else:
+      words = [word for word in self.entries
+        if len(word) > n and word.startswith(prefix)]
+    words.sort(key=lambda word: (-self.score(word), word))
+    return words
+
+
+class MatchCache(object):
+  """The matches found by the last autocompleter, kept so the next one can
+     narrow them down instead of searching again when more of the same word
+     has been typed. The matches are kept as long as the search state they
+     were found in (the documents, the versions of their indexes and so on)
+     is unchanged, except for edits to the line being completed, and the text
+     of that line around the word being completed is unchanged.
+  """
+
+  __slots__ = (
+    'key',       # Search state the matches were found in
+    'index',     # Index of the document completed in
+    'version',   # Version of the index when the matches were found
+    'around',    # Text of the line before the word and after the cursor
+    'prefix',    # Prefix the matches were found for
+    'words',     # Matches produced so far
+    'rest',      # Iterator of the remaining matches
+  )
+
+  def __init__(self):
+    self.clear()
+
+  def clear(self):
+    self.key = self.index = self.rest = None
+    self.prefix = None
+    self.words = []
+
+  def _is_valid(self, key, index, line, around, prefix):
+    if self.prefix is None or not prefix.startswith(self.prefix) or \
+      key != self.key or index is not self.index or around != self.around:
+      return False
+    # Only the line being completed was edited since the matches were found
+    return index.version == self.version or (index.edit_line == line and
+      index.edit_start <= self.version)
+
+  def refine(self, key, index, line, around, prefix, ignore_case=False):
+    """Returns an iterator of the cached matches that start with (and are
+       longer than) the given prefix (or with the lower case prefix in any
+       case), or None if the cached matches were not found in the given
+       state. The cache is left empty.
+    """
+    if not self._is_valid(key, index, line, around, prefix):
+      self.clear()
+      return None
+    words, rest, n = self.words, self.rest, len(prefix)
+    self.clear()
+    if rest is not None:
+      words = itertools.chain(words, rest)
+    # Pauses (None) are kept
+    if ignore_case:
+      return (word for word in words
+        if word is None or is_folded_match(word, prefix))
+    return (word for word in words
+      if word is None or (len(word) > n and word.startswith(prefix)))
+
+  def record(self, key, index, around, prefix, matches):
+    """Caches the matches of the prefix found in the given state. Returns an
+       iterator of the matches, which are cached as it produces them.
+    """
+    self.key, self.index, self.version = key, index, index.version
+    self.around, self.prefix = around, prefix
+    self.words, self.rest = [], iter(matches)
+    return self._iter_matches(self.words, self.rest)
+
+  def _iter_matches(self, words, rest):
+    for word in rest:
+      if word is not None:
+        words.append(word)
+      yield word
+    if self.words is words:
+      self.rest = None
+
+
+class ScanBudget(object):
+  """Limits on the text an autocompleter scans around the cursor, so large
+     documents cannot make a trigger slow. Lines further than lines from the
+     cursor are not scanned, and scanning stops once seconds have passed
+     since the trigger. The words further away are then ranked using the
+     document index, or offered alphabetically if the time is up. A limit of
+     None means no limit.
+  """
+
+  __slots__ = (
+    'lines',     # Lines scanned either side of the cursor
+    'seconds',   # Seconds a trigger may spend scanning and ranking
+    'deadline',  # Time the current trigger must stop scanning by (or None)
+  )
+
+  def __init__(self, lines=1024, seconds=None):
+    self.lines = lines
+    self.seconds = seconds
+    self.deadline = None
+
+  def start(self):
+    """Starts the time allowed for a trigger"""
+    seconds = self.seconds
+    self.deadline = time.time() + seconds if seconds is not None else None
+
+  def is_out_of_time(self):
+    return self.deadline is not None and time.time() >= self.deadline
+
+  def can_scan(self, radius):
+    """Returns true if lines further than radius from the cursor can be
+       scanned
+    """
+    lines = self.lines
+    return (lines is None or radius < lines) and not self.is_out_of_time()
+
+
+class AutoCompleter(object):
+  """Class that actually does the autocompletion"""
+
+  IgnoreUnderscore = True
+  ValidScopes = ('document', 'window', 'application', 'project')
+  ValidOrders = ('alphabetical', 'proximity')
+
+  # Words ranked using the document index between pauses in the search
+  RankChunk = 1024
+
+  # Completions accepted by the autocompleters not given a history
+  History = AcceptHistory()
+
+  # Limits of the autocompleters not given a budget
+  Budget = ScanBudget()
+
+  __slots__ = (
+    'doc',       # The text buffer autocomplete was initiated on
+    'word',      # Word being completed
+    'matches',   # List of potential autocompletions computed so far
+    'candidates', # Generator of the remaining autocompletions
+    'index',     # Index of the next autocompletion to suggest
+    'line',      # Line of the insertion point
+    'column',    # Column of the insertion point
+    'start',     # Column of the start of the word being completed
+    'current',   # Text from start, the word or the last completion inserted
+    'scope',     # Search scope (document|window|application|project)
+    'order',     # Result list ordering (proximity|alphabetical)
+    'promote',   # Promote frequently accepted matches
+    'vocabulary', # Cache of the document indexes
+    'documents', # Returns the text buffers open in a scope
+    'stats',     # Statistics the costs of the triggers are recorded in
+    'project',   # ProjectIndex of the project scope
+    'history',   # AcceptHistory of the completions accepted
+    'accepted',  # Completion inserted last, accepted unless replaced
+    'fuzzy',     # Offer abbreviations and fuzzy matches too
+    'cache',     # MatchCache of the matches found by the last autocompleter
+    'budget',    # ScanBudget limiting the text scanned around the cursor
+    'preview',   # Completion selected but not inserted yet (or None)
+    'word_lists', # WordLists searched after the documents (or None)
+    'smart_case', # Ignore case when the word being completed is lower case
+    'ignore_case', # Whether case is ignored in matching the current word
+  )
+
+  def __init__(self, doc, scope='document', order='alphabetical', 
+    promote=False, vocabulary=None, documents=None, stats=None,
+    project=None, history=None, fuzzy=False, cache=None, budget=None,
+    word_lists=None, smart_case=False):
+    """Create an autocompleter for the document (a TextBuffer). Indexes the
+       words in the current scope and builds a list of matches for the
+       current cursor position. Calling insert_next_completion will cycle
+       through the matches, replacing the last match inserted (if any).
+       Calling preview_next_completion cycles through them without changing
+       the document, until insert_preview inserts the one selected.
+
+       If order is 'alphabetical' then the autocompletion list is ordered 
+       alphabetically. If order is 'proximity' then the autocompletion list
+       is ordered based on distance from the cursor in the current document,
+       with the other open documents being ordered alphabetcially.
+
+       Words are looked up in the indexes held by the given vocabulary cache,
+       which should be shared between autocompleters. The documents function
+       is given the scope and returns the text buffers open in it. The costs
+       of the work done are recorded in the current trigger of the given
+       Statistics (if any). The project scope searches the open documents
+       and the files indexed by the given ProjectIndex.
+
+       If promote is true, the matches accepted before are offered first,
+       ranked by how often and how recently they were accepted (see
+       AcceptHistory). The match inserted last is recorded in the history
+       when accept is called, once the user stops cycling.
+
+       If fuzzy is true, the prefix matches are followed by the words the
+       word being completed abbreviates or is a subsequence of (see
+       FuzzyIndex), which replace the word when inserted.
+
+       Given a MatchCache shared between autocompleters, the matches found
+       for a prefix are narrowed down when the next autocompleter completes
+       a longer prefix of the same word, rather than searched for again.
+
+       The text scanned around the cursor in each trigger is limited by the
+       given ScanBudget (AutoCompleter.Budget by default).
+
+       The words of the given WordLists that match are offered after those
+       of the documents, in alphabetical order, whatever the scope.
+
+       If smart_case is true and the word being completed is all lower case,
+       words are matched whatever their case (using case folded indexes, see
+       FoldedIndex) and inserted as spelt. Otherwise the case must match.
+    """
+    self.scope = scope
+    self.order = order
+    self.promote = promote
+    self.vocabulary = vocabulary if vocabulary is not None else \
+      VocabularyCache()
+    self.documents = documents
+    self.stats = stats
+    self.project = project
+    self.history = history if history is not None else AutoCompleter.History
+    self.accepted = None
+    self.fuzzy = fuzzy
+    self.cache = cache
+    self.budget = budget if budget is not None else AutoCompleter.Budget
+    self.word_lists = word_lists
+    self.smart_case = smart_case
+    self.reindex(doc)
+
+  def _record(self, phase, start, docs=(), size=0, candidates=0):
+    """Records the time since start as spent in the given phase of the
+       current trigger (if triggers are being recorded), along with the
+       documents searched, the bytes read and the candidates found. Returns
+       the current time.
+    """
+    now = time.time()
+    trigger = self.stats.current if self.stats is not None else None
+    if trigger is not None:
+      trigger.add_time(phase, now - start)
+      trigger.documents.update(docs)
+      if size:
+        trigger.add_count('bytes', size)
+      if candidates:
+        trigger.add_count('candidates', candidates)
+    return now
+
+  def _read_lines(self, doc, first, last):
+    """Returns the text of the lines first to last of the document"""
+    start = time.time()
+    text = doc.get_lines_text(first, last)
+    self._record('read', start, (doc,), len(text))
+    return text
+
+  def _is_word_char(self, ch):
+    return ch.isalnum() or (self.IgnoreUnderscore and ch == '_')
+
+  def _get_word_before(self, before):
+    """Returns the word at the end of the text before the cursor"""
+    start = len(before)
+    while start > 0 and self._is_word_char(before[start - 1]):
+      start -= 1
+    return before[start:]
+
+  def _can_autocomplete_at(self, before, after):
+    """Returns true if autocompletion can be done between the text before
+       and after the cursor
+    """
+    if before and self._is_word_char(before[-1]):
+      return True
+    return bool(after) and after[0].isalnum()
+
+  def _get_text_around_cursor(self):
+    """Returns the text of the cursor line before and after the cursor"""
+    before = self.doc.get_text((self.line, 0), (self.line, self.column))
+    text = self._read_lines(self.doc, self.line, self.line)
+    return before, text[len(before):]
+
+  def _get_word_end_at_cursor(self):
+    """Returns the rest of the word the cursor is in (if any)"""
+    match = WORD_REGEX.match(self._get_text_around_cursor()[1])
+    return match.group() if match else ''
+
+  def _find_words(self, text, first, prefix, found):
+    """Records the words in the text (which starts at line first) that begin
+       with the given prefix in found, mapping each word to the smallest
+       (distance, below) key seen for it, where distance is the number of
+       lines from the cursor and below is true for lines after the cursor.
+    """
+    start = time.time()
+    line, n, ignore_case = self.line, len(prefix), self.ignore_case
+    for number, text in enumerate(LINE_REGEX.split(text), first):
+      key = (abs(number - line), number > line)
+      for word in WORD_REGEX.findall(text):
+        if len(word) > n and word.startswith(prefix) or \
+          ignore_case and is_folded_match(word, prefix):
+          if word not in found or key < found[word]:
+            found[word] = key
+    self._record('scan', start)
+
+  def _find_words_on_cursor_line(self, prefix):
+    """Returns the words found by _find_words on the line of the cursor,
+       leaving out the word being completed.
+    """
+    found = {}
+    before, after = self._get_text_around_cursor()
+    self._find_words(before[:len(before) - len(prefix)], self.line, prefix,
+      found)
+    self._find_words(after, self.line, prefix, found)
+    return found
+
+  def _iter_current_doc_words_by_proximity(self, prefix):
+    """Yields the words in the current document that begin with the given
+       prefix, sorted by distance (in lines) from cursor. Words as close above
+       the cursor as below it come first, ties are broken alphabetically.
+
+       Lines are scanned outward from the cursor in growing windows, so the
+       nearest words are found without looking at the rest of the document.
+       Once the lines around the cursor allowed by the budget have been
+       scanned, the remaining words are ranked using the document index (so
+       until the document is fully indexed, only the part indexed so far is
+       searched beyond the scanned lines), RankChunk words at a time. The
+       words left unranked once the time allowed is up are offered after the
+       others, in alphabetical order.
+    """
+    doc = self.doc
+    line = self.line
+    last_line = doc.get_line_count() - 1
+    found = self._find_words_on_cursor_line(prefix)
+    first = last = line
+    radius = 0
+    while True:
+      # Words within radius lines of the cursor are in their final order
+      complete = first == 0 and last == last_line
+      ready = [(key, word) for word, key in found.items()
+        if complete or key[0] <= radius]
+      ready.sort()
+      for key, word in ready:
+        del found[word]
+        yield word
+      if complete or not self.budget.can_scan(radius):
+        break
+      radius = max(radius * 4, 16)
+      if self.budget.lines is not None:
+        radius = min(radius, self.budget.lines)
+      if first > 0:
+        start = max(line - radius, 0)
+        text = self._read_lines(doc, start, first - 1)
+        self._find_words(text, start, prefix, found)
+        first = start
+      if last < last_line:
+        end = min(line + radius, last_line)
+        text = self._read_lines(doc, last + 1, end)
+        self._find_words(text, last + 1, prefix, found)
+        last = end
+      yield None
+    # The word the cursor is in is not a completion of itself
+    word = prefix + self._get_word_end_at_cursor()
+    if not complete:
+      # Rank the words further away using the index, a chunk at a time
+      index = self.vocabulary.get_index(doc)
+      words = index.words_with_prefix(prefix, self.ignore_case)
+      skip = word if word != prefix and index.count(word) == 1 else None
+      ranked, count = [], 0
+      while not self.budget.is_out_of_time():
+        start = time.time()
+        chunk = list(itertools.islice(words, self.RankChunk))
+        start = self._record('lookup', start, (doc,), candidates=len(chunk))
+        for match in chunk:
+          key = index.distance(match, line) if match != skip else None
+          if key is not None:
+            # Ties are broken in the order the words were looked up
+            heapq.heappush(ranked, (key, count, match))
+            count += 1
+        self._record('rank', start)
+        if len(chunk) < self.RankChunk:
+          break
+        yield None
+      while ranked:
+        yield heapq.heappop(ranked)[-1]
+      # The words left once the time is up come alphabetically
+      for match in words:
+        if match != skip:
+          yield match
+    # Until the index is complete, words in the stored vocabulary of the file
+    # come last
+    stored = self.vocabulary.get_stored_words(doc)
+    if stored is not None:
+      for match in stored.words_with_prefix(prefix, self.ignore_case):
+        if match != word:
+          yield match
+
+  def _get_current_doc_words(self, prefix):
+    """Returns the sorted words in the current document that begin with the
+       given prefix. The words are looked up in the document index, and are
+       read from it as they are needed. Until the document is fully indexed,
+       the lines around the cursor allowed by the budget are scanned too, and
+       the stored vocabulary of its file (if any) is searched.
+    """
+    start = time.time()
+    index = self.vocabulary.get_index(self.doc)
+    words = index.words_with_prefix(prefix, self.ignore_case)
+    self._record('lookup', start, (self.doc,))
+    if not index.is_complete():
+      line = self.line
+      radius = self.budget.lines
+      last_line = self.doc.get_line_count() - 1
+      first = max(line - radius, 0) if radius is not None else 0
+      last = min(line + radius, last_line) if radius is not None else last_line
+      found = self._find_words_on_cursor_line(prefix)
+      if first < line and not self.budget.is_out_of_time():
+        text = self._read_lines(self.doc, first, line - 1)
+        self._find_words(text, first, prefix, found)
+      if line < last and not self.budget.is_out_of_time():
+        text = self._read_lines(self.doc, line + 1, last)
+        self._find_words(text, line + 1, prefix, found)
+      start = time.time()
+      stored = self.vocabulary.get_stored_words(self.doc)
+      words = set(words).union(found)
+      if stored is not None:
+        # The word the cursor is in is not a completion of itself
+        word = prefix + self._get_word_end_at_cursor()
+        words.update(match for match in stored.words_with_prefix(prefix,
+          self.ignore_case) if match != word)
+      words = sorted(words, key=fold_key if self.ignore_case else None)
+      self._record('rank', start, candidates=len(words))
+    return words
+
+  def _get_other_docs(self):
+    """Returns the non-current documents in the selected scope"""
+    if self.scope == 'document' or self.documents is None:
+      # No other documents in use
+      return []
+    return [doc for doc in self.documents(self.scope) if doc != self.doc]
+
+  def _iter_other_doc_words(self, prefix):
+    """Yields the words in the non-current documents based on the selected
+       scope that begin with the given prefix, in alphabetical order and
+       without duplicates. The application scope includes the files closed
+       last, the project scope the files in the project. The sorted words of
+       each index are merged as they are needed, so only the words cycled
+       through are ranked.
+    """
+    start = time.time()
+    docs = self._get_other_docs()
+    ignore_case = self.ignore_case
+    words = self.vocabulary.words_with_prefix(docs, prefix, ignore_case)
+    if self.scope == 'application':
+      words.extend(self.vocabulary.closed_words_with_prefix(
+        [self.doc] + docs, prefix, ignore_case))
+    elif self.scope == 'project' and self.project is not None:
+      words.append(self.project.words_with_prefix(prefix, ignore_case))
+    self._record('lookup', start, docs)
+    return merge_words(words, ignore_case)
+
+  def _iter_ordered_matches(self, prefix):
+    """Yields the words that match the given prefix in the selected order,
+       possibly with duplicates and pauses (see _iter_candidate_matches)
+    """
+    if self.order == 'alphabetical':
+      # Alphabetical sort
+      words = self._get_current_doc_words(prefix)
+      yield None
+      words = merge_words([words, self._iter_other_doc_words(prefix)],
+        self.ignore_case)
+    else:
+      # Proximity sort in current doc, alphabetical in others
+      for word in self._iter_current_doc_words_by_proximity(prefix):
+        yield word
+      yield None
+      words = self._iter_other_doc_words(prefix)
+    for word in words:
+      yield word
+    yield None
+    for word in self._iter_word_list_words(prefix):
+      yield word
+
+  def _iter_word_list_words(self, prefix):
+    """Yields the words in the word lists searched in the current document
+       that begin with the given prefix, in alphabetical order and without
+       duplicates
+    """
+    if self.word_lists is None:
+      return
+    start = time.time()
+    words = self.word_lists.words_with_prefix(self.doc.get_language(), prefix,
+      self.ignore_case)
+    self._record('lookup', start)
+    for word in merge_words(words, self.ignore_case):
+      yield word
+
+  def _get_search_state(self):
+    """Returns what the matches depend on, other than the version of the
+       current document's index and the text of the line being completed
+    """
+    state = [self.scope, self.order, self.doc, self.line, self.start,
+      self.word_lists, self.doc.get_language(), self.ignore_case]
+    for doc in [self.doc] + self._get_other_docs():
+      index = self.vocabulary.get_index(doc)
+      state.append((doc, index, index.indexed, index.lines,
+        index.version if doc is not self.doc else None))
+    if self.scope == 'project' and self.project is not None:
+      state.append((self.project, self.project.version))
+    return tuple(state)
+
+  def _get_ordered_matches(self, prefix, around):
+    """Returns an iterator of the words that match the given prefix in the
+       selected order (see _iter_ordered_matches). The cached matches of a
+       shorter prefix of the word are narrowed down if they are still valid.
+       Around is the text of the cursor line before the word being completed
+       and after the cursor.
+
+       Only proximity ordered matches are cached: alphabetical ones are found
+       with binary searches, which is quicker than filtering a list. Nor are
+       the matches of the start of a word, which may be a match of itself.
+    """
+    after = around[1]
+    if self.cache is None or self.order != 'proximity' or \
+      (after and self._is_word_char(after[0])):
+      return self._iter_ordered_matches(prefix)
+    start = time.time()
+    key = self._get_search_state()
+    index = self.vocabulary.get_index(self.doc)
+    words = self.cache.refine(key, index, self.line, around, prefix,
+      self.ignore_case)
+    self._record('lookup', start)
+    if words is None:
+      words = self._iter_ordered_matches(prefix)
+    return self.cache.record(key, index, around, prefix, words)
+
+  def _iter_candidate_matches(self, prefix, around):
+    """Yields the words that match the given prefix, without duplicates, in
+       the order they are offered. Matches are only computed as they are
+       needed, so the first ones are available without ranking all of them.
+
+       None is yielded between the steps of the search (such as scanning a
+       window of lines or ranking words), so the search can be paused there
+       (see find_match).
+    """
+    self.vocabulary.prefetch([self.doc] + self._get_other_docs())
+    yield None
+    seen = set()
+    for word in self._get_promoted_words(prefix):
+      seen.add(word)
+      yield word
+    words = self._get_ordered_matches(prefix, around)
+    if self.fuzzy:
+      words = itertools.chain(words, self._iter_fuzzy_words(prefix))
+    for word in words:
+      if word is None:
+        yield None
+      elif word not in seen:
+        seen.add(word)
+        yield word
+
+  def _iter_fuzzy_words(self, query):
+    """Yields the words in the current document that match the query (see
+       FuzzyIndex), the best matches first, followed by the matches in the
+       other documents of the scope
+    """
+    start = time.time()
+    index = self.vocabulary.get_index(self.doc)
+    words = index.fuzzy_search(query)
+    # The word the cursor is in is not a completion of itself
+    word = query + self._get_word_end_at_cursor()
+    if word != query and index.count(word) == 1 and word in words:
+      words.remove(word)
+    self._record('lookup', start, (self.doc,), candidates=len(words))
+    for word in words:
+      yield word
+    yield None
+    start = time.time()
+    others = self.vocabulary.fuzzy_words(self._get_other_docs(), query)
+    if self.scope == 'project' and self.project is not None:
+      others.update(self.project.fuzzy_search(query))
+    start = self._record('lookup', start, candidates=len(others))
+    query = query.lower()
+    others = sorted(get_fuzzy_key(query, word) for word in others)
+    self._record('rank', start)
+    for key in others:
+      yield key[-1]
+
+  def _get_promoted_words(self, prefix):
+    """Returns the previously accepted words that match the given prefix and
+       occur in the current scope, the highest scoring first
+    """
+    if not self.promote or not len(self.history):
+      return []
+    start = time.time()
+    words = self.history.words_with_prefix(prefix, self.ignore_case)
+    if words:
+      indexes = [self.vocabulary.get_index(doc)
+        for doc in [self.doc] + self._get_other_docs()]
+      words = [word for word in words
+        if any(index.count(word) for index in indexes)]
+    self._record('lookup', start)
+    return words
+
+  def _get_match(self, index):
+    """Returns the match at the given position of the list of matches, or
+       None if there are fewer matches. Further matches are computed as
+       needed.
+    """
+    while index >= len(self.matches) and self.candidates is not None:
+      try:
+        match = next(self.candidates)
+      except StopIteration:
+        self.candidates = None
+        continue
+      if match is not None:
+        self.matches.append(match)
+    return self.matches[index] if index < len(self.matches) else None
+
+  def find_match(self):
+    """Does the work of finding the match to offer next up to the next pause
+       in the search. Returns true once the match is found, or once there are
+       known to be no more matches.
+    """
+    if self.index < len(self.matches) or self.candidates is None:
+      return True
+    try:
+      match = next(self.candidates)
+    except StopIteration:
+      self.candidates = None
+      return True
+    if match is not None:
+      self.matches.append(match)
+    return self.index < len(self.matches)
+
+  def reindex(self, doc):
+    """Starts looking for candidate words for autocompletion at the cursor.
+       The matches are found as they are needed, by has_completions or
+       find_match.
+    """
+    self.doc = doc
+    self.word = None
+    self.matches = []
+    self.candidates = None
+    self.index = 0
+    self.preview = None
+    self.ignore_case = False
+    self.budget.start()
+    self.line, self.column = doc.get_cursor()
+    before, after = self._get_text_around_cursor()
+    if self._can_autocomplete_at(before, after):
+      self.word = self.current = self._get_word_before(before)
+      self.start = self.column - len(self.word)
+      self.ignore_case = self.smart_case and self.word == self.word.lower()
+      self.candidates = self._iter_candidate_matches(self.word,
+        (before[:self.start], after))
+
+  def accept(self):
+    """Records the completion inserted last as accepted"""
+    if self.accepted is not None:
+      self.history.accept(self.accepted)
+      self.accepted = None
+
+  def has_completions(self):
+    """Returns true if we can do autocompletion. Once the matches have been
+       cycled through, the first one is offered again.
+    """
+    if self.index > 0 and self._get_match(self.index) is None:
+      self.index = 0
+    return self.index >= 0 and self._get_match(self.index) is not None
+
+  def _get_common_length(self, match):
+    """Returns the length of the start the match shares with the text from
+       start (the word being completed or the last completion inserted)
+    """
+    current, common = self.current, 0
+    while common < min(len(current), len(match)) and \
+      current[common] == match[common]:
+      common += 1
+    return common
+
+  def _insert_match(self, match):
+    """Replaces the text from start (the word being completed or the last
+       completion inserted) with the match, keeping the text they share,
+       and moves the cursor to the end of the match
+    """
+    start = time.time()
+    self.doc.begin_user_action()
+
+    # Replace the previous completion (or the word being completed),
+    # keeping the text it shares with the new one
+    current, common = self.current, self._get_common_length(match)
+    if common < len(current):
+      self.doc.delete((self.line, self.start + common),
+        (self.line, self.start + len(current)))
+    if common < len(match):
+      self.doc.insert((self.line, self.start + common), match[common:])
+    self.current = self.accepted = match
+
+    # Move cursor
+    self.doc.place_cursor((self.line, self.start + len(match)))
+    start = self._record('edit', start)
+    self.doc.end_user_action()
+    self._record('edit', start)
+
+  def _next_match(self):
+    """Returns the match to offer next and moves on to the following one.
+       The following one is only looked for when it is offered, so whether
+       to go back to the first match is found out then (see has_completions).
+    """
+    match = self._get_match(self.index)
+    self.index += 1
+    return match
+
+  def insert_next_completion(self):
+    """Insert the next autocompletion into the document and move the cursor
+       to the end of the completion. The previous autocompletion is removed.
+    """
+    self.budget.start()
+    insert_ok = self.has_completions()
+    if insert_ok:
+      self._insert_match(self._next_match())
+    return insert_ok
+
+  def preview_next_completion(self):
+    """Selects the next autocompletion without changing the document, so
+       cycling through the completions costs no edits. The selected
+       completion is inserted by insert_preview.
+    """
+    self.budget.start()
+    preview_ok = self.has_completions()
+    if preview_ok:
+      self.preview = self._next_match()
+    return preview_ok
+
+  def get_preview(self):
+    """Returns the column and the text of the preview of the selected
+       completion: the rest of the completion after the text already typed,
+       or the whole completion from the start of the word if the text typed
+       is not a prefix of it. Returns None if no completion is selected.
+    """
+    if self.preview is None:
+      return None
+    if self.preview.startswith(self.current):
+      return self.start + len(self.current), self.preview[len(self.current):]
+    return self.start, self.preview
+
+  def insert_preview(self):
+    """Inserts the completion selected by preview_next_completion (if any)
+       into the document, in a single user action
+    """
+    if self.preview is not None:
+      self._insert_match(self.preview)
+      self.preview = None
+
+
+
+class CompletionRequest(object):
+  """Finds the next completion of an autocompleter without blocking the main
+     loop. The search is done in slices of up to IdleSlice seconds, the first
+     one as soon as the request is started and the others in idle callbacks,
+     registered with idle_add (as for VocabularyCache). Once the completion
+     is found (or there are known to be none), ready is called with the
+     autocompleter, unless the request was cancelled. Without idle_add, the
+     whole search is done when the request is started.
+  """
+
+  IdleSlice = 0.01
+
+  __slots__ = (
+    'completer', # The AutoCompleter searching for completions
+    'ready',     # Called with the autocompleter once the search is done
+    'idle_add',  # Registers an idle callback, returning its source id
+    'source_remove', # Unregisters an idle callback given its source id
+    'idle_id',   # Source id of the idle callback (None if not registered)
+  )
+
+  def __init__(self, completer, ready, idle_add=None, source_remove=None):
+    self.completer = completer
+    self.ready = ready
+    self.idle_add = idle_add
+    self.source_remove = source_remove
+    self.idle_id = None
+
+  def start(self):
+    self.completer.budget.start()
+    self.on_idle()
+
+  def is_pending(self):
+    return self.idle_id is not None
+
+  def cancel(self):
+    """Stops the search. Ready will not be called."""
+    if self.idle_id is not None:
+      self.source_remove(self.idle_id)
+      self.idle_id = None
+    self.ready = None
+
+  def on_idle(self):
+    deadline = time.time() + self.IdleSlice
+    while not self.completer.find_match():
+      if self.idle_add is not None and time.time() >= deadline:
+        if self.idle_id is None:
+          self.idle_id = self.idle_add(self.on_idle)
+        return True
+    self.idle_id = None
+    ready, self.ready = self.ready, None
+    if ready is not None:
+      ready(self.completer)
+    return False
+
+
+class TraceRecorder(object):
+  """Records an editing session to a trace file, so it can be replayed
+     outside of gedit (see tm_autocomplete_replay.py) to measure the latency
+     of real workloads. Each line of the file is a JSON object holding the
+     event, the seconds since recording started and the fields below:
+
+       open      doc, window, text, path, language
+                 A document was seen first, with its text at that point
+       settings  scope, order, promote, fuzzy, smart_case, preview, project
+                 The settings of the autocompleters created from now on
+       insert    doc, line, column, text
+       delete    doc, start, end (as [line, column] pairs)
+                 The user edited the document
+       trigger   doc, line, column
+                 Autocompletion was triggered with the cursor there
+       accept    doc, line, column, text
+       cancel    doc, line, column, text
+                 The completion was accepted or dismissed, leaving the cursor
+                 and the text of its line as given
+       switch    doc
+                 Another document became active
+       close     doc
+                 The document was closed
+
+     Edits made by the autocompleter are not recorded (the recorder is
+     paused meanwhile), they are made again when the trace is replayed.
+     Traces hold the text of the documents edited.
+  """
+
+  __slots__ = (
+    'stream',    # The open trace file
+    'start',     # Time recording started
+    'ids',       # TextBuffer -> id of the document in the trace
+    'windows',   # Window -> id of the window in the trace
+    'settings',  # Settings recorded last
+    'paused',    # Whether edits are left out
+  )
+
+  def __init__(self, filename):
+    self.stream = open(filename, 'w')
+    self.start = time.time()
+    self.ids = {}
+    self.windows = {}
+    self.settings = None
+    self.paused = False
+
+  def _write(self, event, **fields):
+    fields['event'] = event
+    fields['time'] = round(time.time() - self.start, 6)
+    self.stream.write(json.dumps(fields, sort_keys=True) + '\n')
+
+  def is_recorded(self, doc):
+    return doc in self.ids
+
+  def open(self, doc, window=None):
+    """Records the document (a TextBuffer) and the window it is open in, if
+       not recorded yet. Returns its id in the trace.
+    """
+    doc_id = self.ids.get(doc)
+    if doc_id is None:
+      doc_id = self.ids[doc] = len(self.ids)
+      window_id = self.windows.setdefault(window, len(self.windows))
+      last = doc.get_line_count() - 1
+      self._write('open', doc=doc_id, window=window_id,
+        text=doc.get_lines_text(0, last), path=doc.get_file(),
+        language=doc.get_language())
+    return doc_id
+
+  def record_settings(self, **settings):
+    """Records the given settings, if they differ from the last recorded"""
+    if settings != self.settings:
+      self.settings = settings
+      self._write('settings', **settings)
+
+  def record_insert(self, doc, position, text):
+    if not self.paused:
+      self._write('insert', doc=self.open(doc), line=position[0],
+        column=position[1], text=text)
+
+  def record_delete(self, doc, start, end):
+    if not self.paused:
+      self._write('delete', doc=self.open(doc), start=list(start),
+        end=list(end))
+
+  def _record_cursor(self, event, doc, line_text=False):
+    line, column = doc.get_cursor()
+    fields = dict(doc=self.open(doc), line=line, column=column)
+    if line_text:
+      fields['text'] = doc.get_lines_text(line, line)
+    self._write(event, **fields)
+
+  def record_trigger(self, doc):
+    self._record_cursor('trigger', doc)
+
+  def record_accept(self, doc):
+    self._record_cursor('accept', doc, True)
+
+  def record_cancel(self, doc):
+    self._record_cursor('cancel', doc, True)
+
+  def record_switch(self, doc):
+    self._write('switch', doc=self.open(doc))
+
+  def record_close(self, doc):
+    if doc in self.ids:
+      self._write('close', doc=self.ids.pop(doc))
+
+  def flush(self):
+    self.stream.flush()
+
+  def close(self):
+    self.stream.close()
+
+
+# ex:ts=2:sw=2:et:
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+#
+# Replays the editing sessions recorded by the plugin (see TraceRecorder in
+# tm_autocomplete_core.py) without gedit, and reports the latency of the
+# triggers, of the cycles through completions, of the edits (which update
+# the indexes) and of accepting completions. The completions are found and
+# inserted by the current code, so the latencies of two versions can be
+# compared over the same real session.
+#
+# To record a session, set the trace file of the plugin:
+#
+#   gconftool-2 -s -t string /apps/gedit-2/plugins/tm_autocomplete/trace_file
+#     ~/tm_autocomplete.trace
+#
+# Usage: python tm_autocomplete_replay.py [--scope=window] [--order=proximity]
+#   [--promote=yes] [--repeat=3] TRACE...
+#
+# Copyright © 2010, Kevin McGuinness <kevin.mcguinness@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#
+
+import os
+import sys
+import json
+import time
+from optparse import OptionParser
+from tm_autocomplete_core import InMemoryBuffer, VocabularyCache, \
+  AutoCompleter, Statistics, ProjectIndex, AcceptHistory, MatchCache, \
+  ScanBudget
+from tm_autocomplete_bench import percentile
+
+# Kinds of latency reported, in the order they are reported
+KINDS = ('trigger', 'cycle', 'edit', 'accept')
+
+def to_native(fields):
+  """Turns the unicode strings of an event into str (as gedit gives text in
+     UTF-8 under Python 2)
+  """
+  if str is not bytes:
+    return fields
+  return dict((key.encode('utf-8'), value.encode('utf-8')
+    if isinstance(value, unicode) else value)
+    for key, value in fields.items())
+
+def read_trace(filename):
+  """Returns the events of a trace file"""
+  stream = open(filename)
+  try:
+    return [json.loads(line, object_hook=to_native)
+      for line in stream if line.strip()]
+  finally:
+    stream.close()
+
+
+class Replayer(object):
+  """Drives autocompleters through the events of a trace, as the plugin
+     does, and records the seconds taken by each. Settings given override
+     those recorded.
+  """
+
+  def __init__(self, overrides=None, stats=None):
+    self.overrides = overrides or {}
+    self.stats = stats
+    self.settings = {}
+    self.buffers = {}
+    self.windows = {}
+    self.projects = {}
+    self.vocabulary = VocabularyCache()
+    self.history = AcceptHistory()
+    self.matches = MatchCache()
+    self.budget = ScanBudget()
+    self.current = None
+    self.completer = None
+    self.times = dict((kind, []) for kind in KINDS)
+    self.diverged = 0
+
+  def get_setting(self, name, default=None):
+    if name in self.overrides:
+      return self.overrides[name]
+    return self.settings.get(name, default)
+
+  def get_scope_documents(self, scope):
+    if scope in ('application', 'project'):
+      return list(self.buffers.values())
+    if scope == 'window' and self.current is not None:
+      window = self.windows[self.current]
+      return [buffer for buffer in self.buffers.values()
+        if self.windows[buffer] == window]
+    return []
+
+  def get_project(self):
+    """Returns the index of the project recorded, if the project scope is
+       selected and the project directory exists here
+    """
+    root = os.path.expanduser(self.settings.get('project') or '')
+    if self.get_setting('scope') != 'project' or not root or \
+      not os.path.isdir(root):
+      return None
+    if root not in self.projects:
+      self.projects[root] = ProjectIndex(root)
+      self.projects[root].refresh()
+    return self.projects[root]
+
+  def sync_line(self, buffer, event):
+    """Makes the line the cursor was left on match the trace, in case the
+       completion inserted differs from the one recorded
+    """
+    line = min(event['line'], buffer.get_line_count() - 1)
+    text = buffer.get_lines_text(line, line)
+    if text != event['text']:
+      self.diverged += 1
+      buffer.delete((line, 0), (line, len(text)))
+      buffer.insert((line, 0), event['text'])
+    buffer.place_cursor((line, min(event['column'], len(event['text']))))
+
+  def clamp(self, buffer, position):
+    line = min(max(position[0], 0), buffer.get_line_count() - 1)
+    column = min(max(position[1], 0), len(buffer.get_lines_text(line, line)))
+    return line, column
+
+  def on_open(self, event):
+    buffer = InMemoryBuffer(event['text'], event.get('path'),
+      event.get('language'))
+    self.buffers[event['doc']] = buffer
+    self.windows[buffer] = event.get('window')
+
+  def on_settings(self, event):
+    self.settings = event
+    self.completer = None
+    self.matches.clear()
+
+  def on_insert(self, event):
+    buffer = self.buffers[event['doc']]
+    position = self.clamp(buffer, (event['line'], event['column']))
+    start = time.time()
+    buffer.insert(position, event['text'])
+    self.times['edit'].append(time.time() - start)
+
+  def on_delete(self, event):
+    buffer = self.buffers[event['doc']]
+    start, end = self.clamp(buffer, event['start']), \
+      self.clamp(buffer, event['end'])
+    begin = time.time()
+    buffer.delete(start, max(start, end))
+    self.times['edit'].append(time.time() - begin)
+
+  def on_trigger(self, event):
+    buffer = self.current = self.buffers[event['doc']]
+    buffer.place_cursor(self.clamp(buffer, (event['line'], event['column'])))
+    stats = self.stats
+    if stats is not None:
+      stats.begin_trigger()
+    start = time.time()
+    kind = 'cycle'
+    if self.completer is None:
+      kind = 'trigger'
+      self.completer = AutoCompleter(buffer, self.get_setting('scope',
+        'document'), self.get_setting('order', 'proximity'),
+        self.get_setting('promote', True), self.vocabulary,
+        self.get_scope_documents, stats, self.get_project(), self.history,
+        self.get_setting('fuzzy', False), self.matches, self.budget, None,
+        self.get_setting('smart_case', False))
+    completer = self.completer
+    if self.get_setting('preview', False):
+      found = completer.preview_next_completion()
+    else:
+      found = completer.has_completions()
+      if found:
+        completer.insert_next_completion()
+    if not found:
+      self.completer = None
+    self.times[kind].append(time.time() - start)
+    if stats is not None:
+      stats.end_trigger(len(completer.matches))
+
+  def on_accept(self, event):
+    buffer = self.buffers[event['doc']]
+    if self.completer is not None:
+      start = time.time()
+      self.completer.insert_preview()
+      self.completer.accept()
+      self.times['accept'].append(time.time() - start)
+      self.completer = None
+    self.sync_line(buffer, event)
+
+  def on_cancel(self, event):
+    self.completer = None
+    self.sync_line(self.buffers[event['doc']], event)
+
+  def on_switch(self, event):
+    self.current = self.buffers.get(event['doc'])
+
+  def on_close(self, event):
+    buffer = self.buffers.pop(event['doc'], None)
+    if buffer is not None:
+      del self.windows[buffer]
+      if self.current is buffer:
+        self.current = None
+      if self.completer is not None and self.completer.doc is buffer:
+        self.completer = None
+      self.matches.clear()
+      self.vocabulary.drop(buffer)
+
+  def replay(self, events):
+    for event in events:
+      handler = getattr(self, 'on_' + event['event'], None)
+      if handler is not None:
+        handler(event)
+
+  def close(self):
+    self.vocabulary.drop_all()
+    for project in self.projects.values():
+      project.close()
+
+
+def format_latencies(times):
+  return '%6d %8.2f %8.2f %8.2f %8.2f' % ((len(times),) + tuple(1000 * value
+    for value in (percentile(times, 0.5), percentile(times, 0.95),
+    percentile(times, 0.99), max(times or [0]))))
+
+def parse_bool(text):
+  return text.lower() in ('1', 'yes', 'true', 'on')
+
+def main(argv=None):
+  parser = OptionParser(usage='%prog [options] TRACE...')
+  parser.add_option('--scope', choices=AutoCompleter.ValidScopes,
+    help='search scope, instead of the one recorded')
+  parser.add_option('--order', choices=AutoCompleter.ValidOrders,
+    help='completion order, instead of the one recorded')
+  parser.add_option('--promote', metavar='yes|no',
+    help='promote accepted matches, instead of the setting recorded')
+  parser.add_option('--repeat', type='int', default=1,
+    help='times each trace is replayed [%default]')
+  parser.add_option('--phases', action='store_true', default=False,
+    help='report the cost of each phase of the triggers')
+  options, args = parser.parse_args(argv)
+  if not args:
+    parser.error('no trace given')
+
+  overrides = {}
+  if options.scope is not None:
+    overrides['scope'] = options.scope
+  if options.order is not None:
+    overrides['order'] = options.order
+  if options.promote is not None:
+    overrides['promote'] = parse_bool(options.promote)
+  print('%-30s %-6s %6s %8s %8s %8s %8s' % ('trace', 'kind', 'count',
+    'p50 ms', 'p95 ms', 'p99 ms', 'max ms'))
+  for filename in args:
+    events = read_trace(filename)
+    stats = options.phases and Statistics() or None
+    times = dict((kind, []) for kind in KINDS)
+    diverged = 0
+    for i in range(options.repeat):
+      replayer = Replayer(overrides, stats)
+      try:
+        replayer.replay(events)
+      finally:
+        replayer.close()
+      for kind in KINDS:
+        times[kind].extend(replayer.times[kind])
+      diverged += replayer.diverged
+    name = os.path.basename(filename)
+    for kind in KINDS:
+      print('%-30s %-6s %s' % (name, kind, format_latencies(times[kind])))
+    if diverged:
+      print('    %d completions differed from the ones recorded' % diverged)
+    if stats is not None:
+      for line in stats.format_report().splitlines():
+        print('    ' + line)
+    sys.stdout.flush()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
+
+# ex:ts=2:sw=2:et:
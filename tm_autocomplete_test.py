@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+#
+# Tests of the TextMate style autocompletion core: the document indexes kept
+# up to date from edits are checked against the text tokenized from scratch,
+# and the cached matches and merged word lists against fresh searches.
+#
+# Usage: python -m unittest tm_autocomplete_test
+#
+# Copyright © 2010, Kevin McGuinness <kevin.mcguinness@gmail.com>
+#
+# This program is free software; you can redistribute it and/or modify it under
+# the terms of the GNU General Public License as published by the Free Software
+# Foundation; either version 2 of the License, or (at your option) any later
+# version.
+#
+# This program is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU General Public License for more
+# details.
+#
+# You should have received a copy of the GNU General Public License along with
+# this program; if not, write to the Free Software Foundation, Inc., 51
+# Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+#
+
+import random
+import unittest
+from bisect import insort
+from tm_autocomplete_core import WORD_REGEX, MAX_CHAR, InMemoryBuffer, \
+  DocumentIndex, FoldedIndex, VocabularyCache, AutoCompleter, MatchCache, \
+  tokenize_lines, merge_words, iter_sorted, fold_key
+
+# Words the random documents are made of
+WORDS = ['foo', 'foobar', 'foo_bar', 'Foo', 'FOOBAR', 'bar', 'baz', 'qux1',
+  'a', 'fo']
+
+
+class CountingIndex(DocumentIndex):
+  """Document index counting the times the labels are spread out"""
+
+  def __init__(self):
+    DocumentIndex.__init__(self)
+    self.spread = 0
+
+  def _make_room(self, doc, first, count):
+    self.spread += 1
+    return DocumentIndex._make_room(self, doc, first, count)
+
+
+def random_text(rng, lines):
+  return '\n'.join(' '.join(rng.choice(WORDS)
+    for i in range(rng.randint(0, 4))) for j in range(lines))
+
+
+class DocumentIndexTest(unittest.TestCase):
+
+  def setUp(self):
+    self.rng = random.Random(1)
+
+  def index(self, text):
+    doc = InMemoryBuffer(text)
+    index = CountingIndex()
+    index.attach(doc)
+    index.index_lines(doc, doc.get_line_count())
+    return doc, index
+
+  def check(self, doc, index):
+    """Checks the index against the text of the document tokenized from
+       scratch
+    """
+    expected = {}
+    for number, line in enumerate(doc.lines):
+      for word in WORD_REGEX.findall(line):
+        expected.setdefault(word, []).append(number)
+    self.assertTrue(index.is_complete())
+    self.assertEqual(index.lines, doc.get_line_count())
+    self.assertEqual(len(index.labels), doc.get_line_count())
+    labels = list(index.labels)
+    self.assertTrue(all(a < b for a, b in zip(labels, labels[1:])))
+    self.assertEqual(index.words, sorted(expected))
+    self.assertEqual(index.total, sum(len(v) for v in expected.values()))
+    for word, lines in expected.items():
+      self.assertEqual([index._get_line(label)
+        for label in index.positions[word]], lines)
+
+  def edit(self, doc):
+    """Makes a random insertion or deletion, which may span lines"""
+    rng = self.rng
+    line = rng.randrange(doc.get_line_count())
+    column = rng.randint(0, len(doc.lines[line]))
+    if rng.random() < 0.6:
+      doc.insert((line, column), rng.choice(['', '\n', ' ']).join(
+        rng.choice(WORDS) for i in range(rng.randint(1, 3))))
+    else:
+      last = min(line + rng.randint(0, 2), doc.get_line_count() - 1)
+      end = rng.randint(0, len(doc.lines[last]))
+      if last > line or end >= column:
+        doc.delete((line, column), (last, end))
+
+  def test_random_edits(self):
+    doc, index = self.index(random_text(self.rng, 50))
+    for step in range(500):
+      self.edit(doc)
+      self.check(doc, index)
+
+  def test_make_room(self):
+    doc, index = self.index(random_text(self.rng, 20))
+    # Lines inserted at the same place halve the room left there
+    for step in range(200):
+      doc.insert((5, len(doc.lines[5])), '\nfoo bar%d' % step)
+    self.assertTrue(index.spread > 0)
+    self.check(doc, index)
+    for step in range(50):
+      self.edit(doc)
+    self.check(doc, index)
+
+  def test_bulk_edits(self):
+    doc, index = self.index(random_text(self.rng, 100))
+    # Too many lines for the room between two lines
+    doc.insert((50, 3), '\n' + random_text(self.rng, 3000))
+    self.assertTrue(index.spread > 0)
+    self.check(doc, index)
+    doc.delete((10, 0), (2000, 0))
+    self.check(doc, index)
+    # Large insertion at the end, left to background indexing
+    last = doc.get_line_count() - 1
+    doc.insert((last, len(doc.lines[last])), '\n' + random_text(self.rng,
+      DocumentIndex.MaxInsertLines + 10))
+    self.assertFalse(index.is_complete())
+    index.index_lines(doc, DocumentIndex.MaxInsertLines)
+    index.index_lines(doc, DocumentIndex.MaxInsertLines)
+    self.check(doc, index)
+    last = doc.get_line_count() - 1
+    doc.delete((0, 0), (last, len(doc.lines[last])))
+    index.index_lines(doc, 1)
+    self.check(doc, index)
+
+  def test_load(self):
+    text = random_text(self.rng, 200)
+    doc = InMemoryBuffer(text)
+    index = DocumentIndex()
+    index.attach(doc)
+    index.load(*tokenize_lines(text, DocumentIndex.LineSpacing))
+    self.check(doc, index)
+    for step in range(100):
+      self.edit(doc)
+    self.check(doc, index)
+
+  def test_distance(self):
+    doc, index = self.index(random_text(self.rng, 100))
+    for step in range(100):
+      self.edit(doc)
+    for line in range(doc.get_line_count()):
+      for word in index.words:
+        lines = [number for number, text in enumerate(doc.lines)
+          if word in WORD_REGEX.findall(text)]
+        distance, after = index.distance(word, line)
+        self.assertEqual(distance, min(abs(number - line)
+          for number in lines))
+        self.assertEqual(after, distance == 0 or
+          line - distance not in lines)
+
+
+class MatchCacheTest(unittest.TestCase):
+
+  def search(self, doc, cache=None, vocabulary=None):
+    """Returns all the proximity matches at the cursor"""
+    completer = AutoCompleter(doc, 'document', 'proximity', False,
+      vocabulary or VocabularyCache(), cache=cache)
+    while completer._get_match(len(completer.matches)) is not None:
+      pass
+    return completer.matches
+
+  def test_edit_to_cursor_line(self):
+    doc = InMemoryBuffer('foo_one\nx\nfoo_two\nf')
+    doc.place_cursor((3, 1))
+    cache, vocabulary = MatchCache(), VocabularyCache()
+    self.search(doc, cache, vocabulary)
+    index = vocabulary.get_index(doc)
+    key, around = cache.key, cache.around
+    doc.insert((3, 1), 'o')
+    self.assertNotEqual(cache.refine(key, index, 3, around, 'fo'), None)
+
+  def test_edit_to_other_line(self):
+    doc = InMemoryBuffer('a\nfoo_one\nx\nf')
+    cache, vocabulary = MatchCache(), VocabularyCache()
+    vocabulary.get_index(doc)
+    # The last edit before the matches are found is on the line edited next
+    doc.insert((2, 1), 'y')
+    doc.place_cursor((3, 1))
+    self.assertEqual(self.search(doc, cache, vocabulary), ['foo_one'])
+    doc.insert((2, 2), ' foo_two')
+    doc.insert((3, 1), 'o')
+    doc.place_cursor((3, 2))
+    self.assertEqual(self.search(doc, cache, vocabulary),
+      self.search(doc))
+    self.assertEqual(self.search(doc), ['foo_two', 'foo_one'])
+
+  def test_refined_matches(self):
+    rng = random.Random(2)
+    doc = InMemoryBuffer(random_text(rng, 300) + '\nf')
+    doc.place_cursor((300, 1))
+    cache, vocabulary = MatchCache(), VocabularyCache()
+    # Each search narrows down the matches of the one before
+    for ch in 'oo_':
+      self.assertEqual(self.search(doc, cache, vocabulary), self.search(doc))
+      doc.insert(doc.get_cursor(), ch)
+    self.assertEqual(self.search(doc, cache, vocabulary), self.search(doc))
+
+
+class MergeTest(unittest.TestCase):
+
+  def setUp(self):
+    self.rng = random.Random(3)
+    self.words = ['%s%d' % (self.rng.choice(WORDS), self.rng.randrange(300))
+      for i in range(2000)]
+
+  def test_iter_sorted(self):
+    items = sorted(set(self.words))
+    for low, high in (('foo', 'foo' + MAX_CHAR), ('a', 'z'), ('', MAX_CHAR)):
+      self.assertEqual(list(iter_sorted(items, low, high)),
+        [item for item in items if low < item < high])
+
+  def test_iter_sorted_changes(self):
+    items = sorted(set(self.words))
+    found = []
+    for item in iter_sorted(items, 'bar', 'foo'):
+      found.append(item)
+      # Items removed or added meanwhile do not break the order
+      i = self.rng.randrange(len(items))
+      if self.rng.random() < 0.5:
+        del items[i]
+      elif items[i] + '_' not in items:
+        insort(items, items[i] + '_')
+    self.assertEqual(found, sorted(set(found)))
+    self.assertTrue(all('bar' < item < 'foo' for item in found))
+
+  def test_merge_words(self):
+    streams = [sorted(self.rng.sample(self.words, 100)) for i in range(5)]
+    self.assertEqual(list(merge_words(streams)),
+      sorted(set(sum(streams, []))))
+
+  def test_merge_folded_words(self):
+    streams = [sorted(set(self.rng.sample(self.words, 100)), key=fold_key)
+      for i in range(5)]
+    merged = list(merge_words(streams, True))
+    self.assertEqual(merged, sorted(set(sum(streams, [])), key=fold_key))
+
+  def test_folded_index(self):
+    words = sorted(set(self.words))
+    folded = FoldedIndex(words)
+    for prefix in ('foo', 'fo', 'b', 'qux1'):
+      self.assertEqual(list(folded.words_with_prefix(prefix)),
+        sorted([word for word in words if word.lower().startswith(prefix)
+        and word != prefix], key=fold_key))
+
+
+if __name__ == '__main__':
+  unittest.main()
+
+# ex:ts=2:sw=2:et:
@@ -11,6 +11,14 @@ if [ -f $PLUGIN_FOLDER/tm_autocomplete.pyc ]; then
   rm $PLUGIN_FOLDER/tm_autocomplete.pyc
 fi
 
+if [ -f $PLUGIN_FOLDER/tm_autocomplete_core.py ]; then
+  rm $PLUGIN_FOLDER/tm_autocomplete_core.py
+fi
+
+if [ -f $PLUGIN_FOLDER/tm_autocomplete_core.pyc ]; then
+  rm $PLUGIN_FOLDER/tm_autocomplete_core.pyc
+fi
+
 if [ -f $PLUGIN_FOLDER/tm_autocomplete.gedit-plugin ]; then
   rm $PLUGIN_FOLDER/tm_autocomplete.gedit-plugin
 fi